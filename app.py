@@ -1,24 +1,63 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, request, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import os
+import csv
+import io
 import json
+import socket
 import threading
-import main  # Import your scraping script
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_, tuple_
+from sqlalchemy.exc import IntegrityError
 import uuid
-from email_content import generate_outreach_email
+from task_scheduler import TaskScheduler, QueueFullError
+import response_cache
+from singleflight import SingleFlight
+from progress import ProgressBroker, TERMINAL_STATUSES
+from result_store import pack_rows, unpack_rows
+import metrics
+from lazy_import import LazyModule, loaded
+from utils import normalize_domain, normalize_phone, normalize_string
 import collections
+import contextvars
 collections.Iterable = collections.abc.Iterable
 
-app = Flask(__name__)
+# Imported on first use: between them they load selenium, fake_useragent, bs4 and openai,
+# which a worker that only serves /task_status never needs
+main = LazyModule('main')  # Import your scraping script
+email_content = LazyModule('email_content')
+driver_pool = LazyModule('driver_pool')
+email_finder = LazyModule('email_finder')
 
-# Enable CORS
-CORS(app)
+db = SQLAlchemy()
+api = Blueprint('api', __name__)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL').replace("://", "ql://", 1)  # Heroku DATABASE_URL fix
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# "thread": tasks run on the bounded pools below, inside the web process.
+# "db": the web process only records tasks as 'queued' and worker.py processes claim them from the task table.
+TASK_BACKEND = os.environ.get('TASK_BACKEND', 'thread')
+# With TASK_BACKEND=db, new tasks are refused with a 429 once this many are waiting in the task table
+DB_TASK_QUEUE_MAX = int(os.environ.get('DB_TASK_QUEUE_MAX', 500))
+# Either backend records which process holds a queued or running task; the holder keeps extending the lease
+TASK_LEASE_SECONDS = int(os.environ.get('TASK_LEASE_SECONDS', 120))
+TASK_HEARTBEAT_INTERVAL = float(os.environ.get('TASK_HEARTBEAT_INTERVAL', 30))
+
+# Bounded worker pools so a burst of requests queues up instead of starting a thread (and a Chrome) per request
+scheduler = TaskScheduler()
+scheduler.add_pool('yellowpages',
+                   max_workers=int(os.environ.get('YELLOWPAGES_TASK_WORKERS', 4)),
+                   max_queue=int(os.environ.get('YELLOWPAGES_TASK_QUEUE', 100)))
+scheduler.add_pool('contacts',
+                   max_workers=int(os.environ.get('CONTACTS_TASK_WORKERS', 2)),
+                   max_queue=int(os.environ.get('CONTACTS_TASK_QUEUE', 50)))
+scheduler.add_pool('email',
+                   max_workers=int(os.environ.get('EMAIL_TASK_WORKERS', 2)),
+                   max_queue=int(os.environ.get('EMAIL_TASK_QUEUE', 50)))
+# Bulk jobs run their searches on a worker set of their own (BULK_SEARCH_WORKERS), so few of them run at once
+scheduler.add_pool('bulk',
+                   max_workers=int(os.environ.get('BULK_TASK_WORKERS', 1)),
+                   max_queue=int(os.environ.get('BULK_TASK_QUEUE', 10)))
 
 # Define the Task model
 class Task(db.Model):
@@ -26,46 +65,770 @@ class Task(db.Model):
     task_id = db.Column(db.String(36), unique=True, nullable=False)
     status = db.Column(db.String(20), nullable=False)
     result = db.Column(db.Text, nullable=True)
+    params = db.Column(db.Text, nullable=True)  # JSON of the task kind and its inputs, so the task can be resumed
+    timings = db.Column(db.Text, nullable=True)  # JSON of the time spent per stage, for /task_status
+    # Which process holds the task (worker.py, or the web process with the thread backend) and until when
+    queued_at = db.Column(db.DateTime, nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    attempts = db.Column(db.Integer, nullable=True)
+    # worker.py polls for the oldest queued task; without this every poll scans every task ever run
+    __table_args__ = (db.Index('ix_task_status_queued_at', 'status', 'queued_at'),)
 
-    def __init__(self, task_id, status, result=None):
+    def __init__(self, task_id, status, result=None, params=None, queued_at=None):
         self.task_id = task_id
         self.status = status
         self.result = result
+        self.params = params
+        self.queued_at = queued_at
+
+# Result rows of a task, appended in batches while it runs instead of rewritten as one blob at the end
+class TaskResultBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.String(36), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.Text, nullable=False, default='')  # JSON rows of batches written before `packed`
+    packed = db.Column(db.LargeBinary, nullable=True)  # Compressed columnar rows, see result_store.pack_rows
+    __table_args__ = (db.UniqueConstraint('task_id', 'seq'),)
+
+# Work items (e.g. domains of a batch) whose results are saved, so a restarted task can skip them
+class TaskCheckpoint(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.String(36), nullable=False, index=True)
+    item = db.Column(db.String(255), nullable=False)
+    failed = db.Column(db.Boolean, nullable=True)  # So a resumed task can count its failures without reading rows
+    __table_args__ = (db.UniqueConstraint('task_id', 'item'),)
+
+# Contact lookups shared by every worker process, keyed by normalized domain.
+# A 'pending' row marks a lookup that is in flight somewhere so other workers wait for it instead of starting Chrome.
+class ContactCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    domain = db.Column(db.String(255), unique=True, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False)
+    result = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+# Every business any search has returned, so overlapping searches can reuse what is already known.
+# Looked up by normalized phone, website domain, or normalized name within a city; each has its own index.
+# One entry per phone number: a phone number belongs to one branch of a business.
+class Company(db.Model):
+    __tablename__ = 'company_t'
+    id = db.Column(db.Integer, primary_key=True)
+    phone_key = db.Column(db.String(20), nullable=True)
+    domain_key = db.Column(db.String(255), nullable=True, index=True)
+    name_key = db.Column(db.String(255), nullable=True)
+    city_key = db.Column(db.String(100), nullable=True)
+    title = db.Column(db.String(255), nullable=True)
+    phone_number = db.Column(db.String(50), nullable=True)
+    website_url = db.Column(db.Text, nullable=True)
+    full_address = db.Column(db.String(255), nullable=True)
+    city = db.Column(db.String(100), nullable=True)
+    state = db.Column(db.String(50), nullable=True)
+    zip_code = db.Column(db.String(20), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (db.Index('ix_company_t_name_city', 'name_key', 'city_key'),
+                      db.Index('ux_company_t_phone_key', 'phone_key', unique=True))
+
+def ensure_schema():
+    """
+    Creates missing tables and adds the columns and indexes introduced after the task tables were first created.
+    Only nullable columns are added, so this is safe to run on every boot.
+    """
+    db.create_all()
+    for model in (Task, TaskResultBatch, TaskCheckpoint, Company):
+        table = model.__tablename__
+        inspector = db.inspect(db.engine)
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table)}
+        with db.engine.begin() as conn:
+            for column in model.__table__.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(db.engine.dialect)
+                    conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column.name} {column_type}'))
+            # ADD COLUMN leaves out the column's index=True, and create_all skips tables that already exist
+            for index in model.__table__.indexes:
+                if index.name not in existing_indexes:
+                    if index.unique and len(index.columns) == 1:
+                        # Rows written before the index existed may repeat a key; all but the newest give theirs up
+                        column = index.columns[0].name
+                        conn.execute(db.text(f'UPDATE {table} SET {column} = NULL WHERE {column} IS NOT NULL AND id NOT IN '
+                                             f'(SELECT MAX(id) FROM {table} WHERE {column} IS NOT NULL GROUP BY {column})'))
+                    index.create(bind=conn)
+
+CONTACT_CACHE_TTL = timedelta(seconds=int(os.environ.get('CONTACT_CACHE_TTL', 7 * 24 * 3600)))
+CONTACT_INFLIGHT_TIMEOUT = timedelta(seconds=int(os.environ.get('CONTACT_INFLIGHT_TIMEOUT', 300)))
+contact_lookups = SingleFlight()
+
+# Progress events of the tasks running in this process, for /task_events
+progress_broker = ProgressBroker()
+TASK_EVENTS_MAX_WAIT = float(os.environ.get('TASK_EVENTS_MAX_WAIT', 30))
+TASK_EVENTS_MAX_STREAM = float(os.environ.get('TASK_EVENTS_MAX_STREAM', 600))
+TASK_EVENTS_DB_POLL = float(os.environ.get('TASK_EVENTS_DB_POLL', 2))
+
+def publish_progress(task_id, event, data=None):
+    # With TASK_BACKEND=db tasks run in worker.py, so the web process would only ever see their 'queued' event;
+    # /task_events watches the task table for them instead
+    if TASK_BACKEND != 'db':
+        progress_broker.publish(task_id, event, data)
+
+RESULT_FLUSH_SIZE = int(os.environ.get('RESULT_FLUSH_SIZE', 50))
+RESULT_FLUSH_INTERVAL = float(os.environ.get('RESULT_FLUSH_INTERVAL', 10))
+
+class LeaseLost(Exception):
+    """
+    Raised in worker.py when the lease on the running task has run out and the task may already be running elsewhere,
+    so this copy must stop writing.
+    """
+
+class TaskLease:
+    """
+    The lease a worker.py thread holds on the task it runs. `lost` is set once renewing it fails.
+    """
+
+    def __init__(self, task_id, worker_id, seconds):
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.seconds = seconds
+        self.lost = threading.Event()
+
+# The lease of the task the current worker.py thread runs; None with the thread backend
+current_lease = contextvars.ContextVar('current_lease', default=None)
+
+def check_lease(task_id, renew=True):
+    """
+    Fences a task's writes: extends the lease inside the current transaction, so whatever is committed with it
+    is only written while this worker still holds the task. Does nothing outside worker.py.
+    :param renew: False to only check whether the lease was already found lost, without a query.
+    :raise LeaseLost: If the task was requeued or claimed by another worker; the transaction is rolled back.
+    """
+    lease = current_lease.get()
+    if lease is None or lease.task_id != task_id:
+        return
+    if not lease.lost.is_set():
+        if not renew:
+            return
+        renewed = Task.query.filter_by(task_id=task_id, worker_id=lease.worker_id) \
+            .update({"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease.seconds)},
+                    synchronize_session=False)
+        if renewed:
+            return
+        lease.lost.set()
+    db.session.rollback()
+    raise LeaseLost(f"Task {task_id} is no longer leased to {lease.worker_id}")
 
 def update_task_status_and_result(task_id, status, result=None):
     task = Task.query.filter_by(task_id=task_id).first()
     if task:
+        status_changed = task.status != status
         task.status = status
         if result is not None:
             task.result = json.dumps(result)  # Serialize result to JSON string
+        try:
+            check_lease(task_id)
+        except LeaseLost as e:
+            print(f"Not setting task {task_id} to '{status}': {e}")
+            return
+        with metrics.timer('db_commit'):
+            db.session.commit()
+        if status_changed:
+            publish_progress(task_id, 'status', {"status": status})
+
+class ResultWriter:
+    """
+    Appends a task's result rows to task_result_batch every RESULT_FLUSH_SIZE rows or RESULT_FLUSH_INTERVAL seconds.
+    Checkpoints and the task's summary are committed together with the rows they cover,
+    so after a restart the saved checkpoints match the saved rows exactly.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        last_seq = db.session.query(db.func.max(TaskResultBatch.seq)).filter_by(task_id=task_id).scalar()
+        self.seq = last_seq or 0
+        self._rows = []
+        self._checkpoints = []
+        self._summary = None
+        self._flushed_at = time.monotonic()
+
+    def add(self, rows, checkpoint=None, summary=None, failed=False):
+        """
+        :param checkpoint: Key of the work item these rows finish.
+        :param failed: Whether that item failed; saved with its checkpoint.
+        """
+        check_lease(self.task_id, renew=False)  # Stops a worker.py task as soon as its heartbeat lost the lease
+        self._rows.extend(rows)
+        if checkpoint is not None:
+            self._checkpoints.append((checkpoint, failed))
+        if summary is not None:
+            self._summary = summary
+        if len(self._rows) >= RESULT_FLUSH_SIZE or time.monotonic() - self._flushed_at >= RESULT_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self.seq += 1
+            db.session.add(TaskResultBatch(task_id=self.task_id, seq=self.seq, row_count=len(self._rows),
+                                           data='', packed=pack_rows(self._rows)))
+        for item, failed in self._checkpoints:
+            db.session.add(TaskCheckpoint(task_id=self.task_id, item=item, failed=failed))
+        if self._summary is not None:
+            Task.query.filter_by(task_id=self.task_id).update({"result": json.dumps(self._summary)})
+        check_lease(self.task_id)
+        with metrics.timer('db_commit'):
+            db.session.commit()
+        self._rows, self._checkpoints, self._summary = [], [], None
+        self._flushed_at = time.monotonic()
+
+def clear_task_results(task_id):
+    TaskResultBatch.query.filter_by(task_id=task_id).delete()
+    TaskCheckpoint.query.filter_by(task_id=task_id).delete()
+    check_lease(task_id)
+    db.session.commit()
+
+def batch_rows(batch):
+    return unpack_rows(batch.packed) if batch.packed is not None else json.loads(batch.data)
+
+def iter_result_rows(task_id, offset=0, limit=None):
+    """
+    Yields a task's result rows in the order they were saved, decoding only the batches that hold
+    rows offset..offset+limit, a few batches at a time.
+    """
+    wanted = []
+    position = 0
+    batch_sizes = db.session.query(TaskResultBatch.id, TaskResultBatch.row_count) \
+        .filter_by(task_id=task_id).order_by(TaskResultBatch.seq)
+    for batch_id, row_count in batch_sizes:
+        if position + row_count > offset and (limit is None or position < offset + limit):
+            wanted.append((batch_id, position))
+        position += row_count
+
+    remaining = limit
+    for i in range(0, len(wanted), 20):
+        chunk = wanted[i:i + 20]
+        batches = {batch.id: batch for batch in TaskResultBatch.query.filter(
+            TaskResultBatch.id.in_([batch_id for batch_id, _ in chunk]))}
+        for batch_id, start in chunk:
+            rows = batch_rows(batches[batch_id])[max(0, offset - start):]
+            if remaining is not None:
+                rows = rows[:remaining]
+                remaining -= len(rows)
+            yield from rows
+        for batch in batches.values():
+            db.session.expunge(batch)  # Keeps memory flat while a large result is read
+
+def count_result_rows(task_id):
+    return db.session.query(db.func.coalesce(db.func.sum(TaskResultBatch.row_count), 0)) \
+        .filter_by(task_id=task_id).scalar()
+
+def load_checkpoints(task_id):
+    """
+    :return: (keys of the items already finished, how many of them failed), read from the checkpoints alone.
+    """
+    done, failed = set(), 0
+    for item, item_failed in db.session.query(TaskCheckpoint.item, TaskCheckpoint.failed).filter_by(task_id=task_id):
+        done.add(item)
+        failed += bool(item_failed)
+    return done, failed
+
+def task_kind(task):
+    return json.loads(task.params).get("kind") if task.params else None
+
+def build_task_result(task, offset=0, limit=None):
+    """
+    :param offset: Number of result rows to skip, in the order they were saved.
+    :param limit: Maximum number of result rows to include; all of them by default.
+    """
+    summary = json.loads(task.result) if task.result else None  # Deserialize result from JSON string
+    kind = task_kind(task)
+    if kind is None or task.status == 'error':
+        return summary  # Tasks from before incremental results, and error messages
+    if kind == 'bulk':
+        # A bulk job can have hundreds of thousands of rows; they are read through /task_export instead
+        return dict(summary or {}, export=f"/task_export/{task.task_id}")
+    rows = list(iter_result_rows(task.task_id, offset, limit))
+    if kind == 'contacts_batch':
+        domains = {row["domain"]: {key: value for key, value in row.items() if key != "domain"} for row in rows}
+        return dict(summary or {}, domains=domains)
+    if kind == 'email_batch':
+        # In the order the emails finished, like every other kind's rows; each row carries its lead's index
+        return dict(summary or {}, emails=rows)
+    return rows
+
+# Search result fields and the matching columns of company_t
+COMPANY_FIELDS = {"title": "Company_name", "phone_number": "Phone_no", "website_url": "Website",
+                  "full_address": "Address", "city": "City", "state": "State", "zip_code": "Zipcode"}
+# The fields every branch of a business shares, so a website or name match can supply them
+BUSINESS_FIELDS = ("title", "website_url")
+
+def company_keys(title, phone_number, website_url, city):
+    return {"phone_key": normalize_phone(phone_number), "domain_key": normalize_domain(website_url),
+            "name_key": normalize_string(title) if title else None,
+            "city_key": city.strip().lower() if city else None}
+
+def lookup_companies(keys):
+    """
+    Loads the lead index entries matching any of the keys, with one indexed query per kind of key.
+    :return: Entries by phone key, and lists of entries by domain key and by (name key, city key).
+    """
+    phones = {k["phone_key"] for k in keys if k["phone_key"]}
+    domains = {k["domain_key"] for k in keys if k["domain_key"]}
+    names = {(k["name_key"], k["city_key"]) for k in keys if k["name_key"] and k["city_key"]}
+
+    by_phone, by_domain, by_name = {}, collections.defaultdict(list), collections.defaultdict(list)
+    if phones:
+        by_phone = {c.phone_key: c for c in Company.query.filter(Company.phone_key.in_(phones))}
+    if domains:
+        for c in Company.query.filter(Company.domain_key.in_(domains)):
+            by_domain[c.domain_key].append(c)
+    if names:
+        for c in Company.query.filter(tuple_(Company.name_key, Company.city_key).in_(names)):
+            by_name[(c.name_key, c.city_key)].append(c)
+    return by_phone, by_domain, by_name
+
+def match_company(keys, full_address, by_phone, by_domain, by_name):
+    """
+    Chain branches share a website and usually a name, so only a phone match, or a website or name match
+    at the same street address, is the same branch.
+    :return: The matching entry or None, and whether it is the same branch.
+    """
+    if keys["phone_key"] in by_phone:
+        return by_phone[keys["phone_key"]], True
+    candidates = by_domain.get(keys["domain_key"], []) + by_name.get((keys["name_key"], keys["city_key"]), [])
+    for company in candidates:
+        # A different phone number at the same address is another business sharing the building
+        if (full_address and company.full_address and not (keys["phone_key"] and company.phone_key)
+                and normalize_string(company.full_address) == normalize_string(full_address)):
+            return company, True
+    return (candidates[0], False) if candidates else (None, False)
+
+def find_known_companies(listings):
+    """
+    Looks a page of listings up in the lead index. The same branch supplies every known field,
+    another branch of the same business only its name and website.
+    :param listings: Listing dicts as produced by yellowpages_scraper.parse_listing.
+    :return: For each listing, a dict of the known fields or None.
+    """
+    keys = [company_keys(listing["title"], listing["phone_number"], listing["website_url"], listing["city"])
+            for listing in listings]
+    by_phone, by_domain, by_name = lookup_companies(keys)
+
+    known = []
+    for listing, k in zip(listings, keys):
+        company, same_branch = match_company(k, listing["full_address"], by_phone, by_domain, by_name)
+        fields = COMPANY_FIELDS if same_branch else BUSINESS_FIELDS
+        known.append({field: getattr(company, field) for field in fields} if company else None)
+    hits = sum(1 for item in known if item)
+    if hits:
+        print(f"Lead index: {hits} of {len(listings)} incomplete listings already known")
+    return known
+
+def remember_companies(rows):
+    """
+    Adds the scraped rows to the lead index, or updates the entry of the same branch, with one batch of lookups.
+    :param rows: Rows as formatted by main.format_yellow_pages_data.
+    """
+    keys = [company_keys(row.get("Company_name"), row.get("Phone_no"), row.get("Website"), row.get("City"))
+            for row in rows]
+    for attempt in (1, 2):
+        by_phone, by_domain, by_name = lookup_companies(keys)
+        now = datetime.utcnow()
+        for row, k in zip(rows, keys):
+            company, same_branch = match_company(k, row.get("Address"), by_phone, by_domain, by_name)
+            if not same_branch:
+                company = Company(updated_at=now)
+                db.session.add(company)
+            for column, value in k.items():
+                if value and not getattr(company, column):
+                    setattr(company, column, value)
+            for field, column in COMPANY_FIELDS.items():
+                if row.get(column):
+                    setattr(company, field, row[column])
+            company.updated_at = now
+            # So a later row of the same branch on this page updates this entry instead of adding another
+            if company.phone_key:
+                by_phone[company.phone_key] = company
+            if not same_branch and company.domain_key:
+                by_domain[company.domain_key].append(company)
+            if not same_branch and company.name_key and company.city_key:
+                by_name[(company.name_key, company.city_key)].append(company)
+        try:
+            db.session.commit()
+            return
+        except IntegrityError:
+            # Another task added one of these phone numbers since the lookup; the second pass updates its entry
+            db.session.rollback()
+            if attempt == 2:
+                raise
+
+def process_id():
+    # Worked out per call: with gunicorn --preload the module is imported before the workers fork
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def lease_values(worker_id):
+    return {"worker_id": worker_id, "lease_expires_at": datetime.utcnow() + timedelta(seconds=TASK_LEASE_SECONDS)}
+
+def renew_lease(task_id, worker_id):
+    """
+    :return: False if the task is no longer leased to `worker_id`.
+    """
+    renewed = Task.query.filter_by(task_id=task_id, worker_id=worker_id) \
+        .update(lease_values(worker_id), synchronize_session=False)
+    db.session.commit()
+    return bool(renewed)
+
+def release_lease(task_id, worker_id):
+    Task.query.filter_by(task_id=task_id, worker_id=worker_id) \
+        .update({"worker_id": None, "lease_expires_at": None}, synchronize_session=False)
+    db.session.commit()
+
+# Leases of the tasks queued or running on this process's pools (thread backend), by task id
+local_runs = {}
+local_runs_lock = threading.Lock()
+_lease_keeper_pid = None
+
+def keep_local_leases():
+    # Extends the leases of this process's queued and running tasks; a task whose lease was lost stops at its next write
+    while True:
+        time.sleep(TASK_HEARTBEAT_INTERVAL)
+        with local_runs_lock:
+            leases = [lease for lease in local_runs.values() if not lease.lost.is_set()]
+        with app.app_context():
+            for lease in leases:
+                try:
+                    if not renew_lease(lease.task_id, lease.worker_id):
+                        print(f"Lost the lease on task {lease.task_id}, stopping it")
+                        lease.lost.set()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Renewing the lease on task {lease.task_id} failed: {e}")
+
+def start_lease_keeper():
+    # Started on the first submit rather than at import, so a --preload master never starts it before forking
+    global _lease_keeper_pid
+    with local_runs_lock:
+        if _lease_keeper_pid == os.getpid():
+            return
+        _lease_keeper_pid = os.getpid()
+    threading.Thread(target=keep_local_leases, name='lease-keeper', daemon=True).start()
+
+def run_task(target, task_id, kind, pool_name, queued_at, args):
+    # Runs a task function, then stores how long its stages took next to its result
+    metrics.observe('task_queue_wait', time.monotonic() - queued_at, pool=pool_name)
+    with local_runs_lock:
+        lease = local_runs.get(task_id)
+    # worker.py sets the lease itself; on the thread backend it is the one taken when the task was submitted
+    token = current_lease.set(lease) if lease is not None else None
+    try:
+        with metrics.task_timings() as timings:
+            started = time.monotonic()
+            target(task_id=task_id, **args)
+            metrics.observe('task_run', time.monotonic() - started, kind=kind)
+    finally:
+        if lease is not None:
+            current_lease.reset(token)
+            with local_runs_lock:
+                local_runs.pop(task_id, None)
+            with app.app_context():
+                release_lease(task_id, lease.worker_id)
+    if not metrics.METRICS_ENABLED:
+        return
+    breakdown = dict(timings.snapshot(), total={"count": 1, "seconds": round(time.monotonic() - queued_at, 4)},
+                     queue_wait={"count": 1, "seconds": round(started - queued_at, 4)})
+    with app.app_context():
+        Task.query.filter_by(task_id=task_id).update({"timings": json.dumps(breakdown)})
+        try:
+            check_lease(task_id)
+        except LeaseLost:
+            return
         db.session.commit()
 
+def submit_task(task_id, kind, args):
+    """
+    With the thread backend the task row must already be leased to process_id(); the lease is then kept up
+    until the task has run.
+    """
+    if TASK_BACKEND == 'db':
+        # The 'queued' row is the job and a worker process claims it; it already counts towards the limit here
+        if db_queue_counts()["queued"] > DB_TASK_QUEUE_MAX:
+            raise QueueFullError('db', 30)
+        return
+    pool_name, target = TASK_KINDS[kind]
+    with local_runs_lock:
+        local_runs[task_id] = TaskLease(task_id, process_id(), TASK_LEASE_SECONDS)
+    start_lease_keeper()
+    try:
+        scheduler.submit(pool_name, run_task, target, task_id, kind, pool_name, time.monotonic(), args)
+    except QueueFullError:
+        with local_runs_lock:
+            local_runs.pop(task_id, None)
+        raise
+
+def enqueue_task(kind, **args):
+    # The row is created as 'queued' first so the worker always finds it, and removed again if the pool rejects it
+    task_id = str(uuid.uuid4())
+    new_task = Task(task_id=task_id, status='queued', params=json.dumps({"kind": kind, "args": args}),
+                    queued_at=datetime.utcnow())
+    if TASK_BACKEND != 'db':
+        new_task.worker_id, new_task.lease_expires_at = lease_values(process_id()).values()
+    db.session.add(new_task)
+    db.session.commit()
+    publish_progress(task_id, 'status', {"status": 'queued'})
+
+    try:
+        submit_task(task_id, kind, args)
+    except QueueFullError:
+        progress_broker.discard(task_id)
+        db.session.delete(new_task)
+        db.session.commit()
+        raise
+    return task_id
 
+@api.app_errorhandler(QueueFullError)
+def queue_full(e):
+    return jsonify({"error": "Too many tasks in progress. Please retry later.",
+                    "retry_after": e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
 
+@api.app_errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"error": f"Request body too large, the limit is {os.environ.get('MAX_UPLOAD_MB', 16)} MB"}), 413
 
-def scrape_yellow_pages_task(searchterm, location, leadid, task_id):
+def claim_contact_lookup(domain):
+    """
+    Returns cached contacts for the domain, or None once this worker holds the 'pending' claim and must scrape.
+    Waits while another worker's lookup for the same domain is in flight.
+    """
+    while True:
+        now = datetime.utcnow()
+        entry = ContactCache.query.filter_by(domain=domain).first()
+        if entry and entry.status == 'ready' and now - entry.updated_at < CONTACT_CACHE_TTL:
+            return json.loads(entry.result)
+        if entry and entry.status == 'pending' and now - entry.updated_at < CONTACT_INFLIGHT_TIMEOUT:
+            db.session.rollback()  # End the transaction so the next read sees the other worker's commit
+            time.sleep(2)
+            continue
+
+        if entry is None:
+            db.session.add(ContactCache(domain=domain, status='pending', updated_at=now))
+            try:
+                db.session.commit()
+                return None
+            except IntegrityError:
+                db.session.rollback()  # Another worker claimed it first
+                continue
+
+        # Stale or expired: only the worker whose conditional update lands gets to scrape
+        claimed = ContactCache.query.filter_by(id=entry.id, status=entry.status, updated_at=entry.updated_at) \
+            .update({"status": "pending", "updated_at": now})
+        db.session.commit()
+        if claimed:
+            return None
+
+def scrape_contacts_shared(domain):
+    contacts = claim_contact_lookup(domain)
+    if contacts is not None:
+        return contacts
+
+    contacts = None
+    try:
+        contacts = main.find_contacts(domain)
+    finally:
+        entry = ContactCache.query.filter_by(domain=domain).first()
+        if entry is not None and contacts:
+            entry.status = 'ready'
+            entry.result = json.dumps(contacts)
+            entry.updated_at = datetime.utcnow()
+        elif entry is not None:
+            # Failed or empty lookups are not cached, so the next request tries again
+            db.session.delete(entry)
+        db.session.commit()
+    return contacts
+
+def cached_find_contacts(website_url):
+    domain = normalize_domain(website_url) or website_url
+    return contact_lookups.do(domain, lambda: scrape_contacts_shared(domain))
+
+def cached_find_contacts_in_context(website_url):
+    # Used from the batch's pool threads, which do not have an application context of their own
+    with app.app_context():
+        return cached_find_contacts(website_url)
+
+
+def scrape_yellow_pages_task(searchterm, location, leadid, max_pages, max_results, use_cache, task_id):
     with app.app_context():  # Push the application context
         try:
-            result = []
-            for progress_update in main.scrape_yellow_pages(searchterm, location, leadid):
-                result.append(progress_update)
-            update_task_status_and_result(task_id, 'success', result)
+            update_task_status_and_result(task_id, 'progressing')
+            clear_task_results(task_id)  # A restarted search starts over
+            writer = ResultWriter(task_id)
+
+            def save_rows(rows):
+                # Each page is saved as soon as it is done, so a crash keeps the pages already scraped
+                writer.add(rows)
+                writer.flush()
+                publish_progress(task_id, 'rows', {"rows": rows})
+                try:
+                    remember_companies(rows)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Could not update the lead index: {e}")
+
+            if main.scrape_yellow_pages(searchterm, location, leadid, max_pages, max_results, use_cache,
+                                        on_rows=save_rows, lookup_known=find_known_companies) is None:
+                raise RuntimeError("Scraping Yellow Pages returned no results")
+            update_task_status_and_result(task_id, 'success')
         except Exception as e:
             update_task_status_and_result(task_id, 'error', {'message': str(e)})
 
 def find_contacts_task(website_url, task_id):
     with app.app_context():  # Push the application context
         try:
-            result = []
-            for progress_update in main.find_contacts(website_url):
-                result.append(progress_update)
-            update_task_status_and_result(task_id, 'success', result)
+            update_task_status_and_result(task_id, 'progressing')
+            clear_task_results(task_id)
+            contacts = cached_find_contacts(website_url)
+            if contacts is None:
+                raise RuntimeError("Contact lookup failed")
+            writer = ResultWriter(task_id)
+            writer.add(contacts)
+            writer.flush()
+            publish_progress(task_id, 'rows', {"rows": contacts})
+            update_task_status_and_result(task_id, 'success')
+        except Exception as e:
+            update_task_status_and_result(task_id, 'error', {'message': str(e)})
+
+def run_batch(task_id, items, summary, process, handle, checkpoint_key=str):
+    """
+    The resumable loop of the batch tasks. Items checkpointed before a restart already have their rows saved
+    and are skipped; each finished item's rows are saved together with its checkpoint and the summary.
+    :param items: The task's work items.
+    :param summary: Summary of a fresh run, with "completed" and "failed" counts; on a resume the completed and
+                    failed counts come from the checkpoints and the other totals from the saved summary.
+    :param process: Called with the items still to do; yields (position among them, result, error) per item.
+    :param handle: Called with (index, item, result, error, summary); returns the item's result rows and may update
+                   the summary's other totals.
+    :param checkpoint_key: Turns an item's index into its checkpoint key.
+    """
+    done, failed = load_checkpoints(task_id)
+    if done:
+        previous = json.loads(Task.query.filter_by(task_id=task_id).first().result or 'null')
+        # A task that ended in an error had its summary replaced by the message, hence the checks
+        if isinstance(previous, dict):
+            summary.update((key, value) for key, value in previous.items() if key in summary)
+        summary.update(completed=len(done), failed=failed)
+    writer = ResultWriter(task_id)
+    writer.add([], summary=dict(summary))
+    writer.flush()
+
+    remaining = [index for index in range(len(items)) if checkpoint_key(index) not in done]
+    for position, result, error in process([items[index] for index in remaining]):
+        index = remaining[position]
+        summary["completed"] += 1
+        if error is not None:
+            summary["failed"] += 1
+        rows = handle(index, items[index], result, error, summary)
+        writer.add(rows, checkpoint=checkpoint_key(index), summary=dict(summary), failed=error is not None)
+    writer.flush()
+
+def find_contacts_batch_task(domains, task_id):
+    with app.app_context():  # Push the application context
+        try:
+            update_task_status_and_result(task_id, 'progressing')
+            workers = int(os.environ.get('CONTACTS_BATCH_WORKERS', driver_pool.get_pool().size))
+
+            def lookup(remaining):
+                positions = {domain: position for position, domain in enumerate(remaining)}
+                for domain, contacts, error in main.find_contacts_batch(remaining, max_workers=workers,
+                                                                       lookup=cached_find_contacts_in_context):
+                    yield positions[domain], contacts, error
+
+            def handle(index, domain, contacts, error, summary):
+                publish_progress(task_id, 'rows', {"domain": domain, "rows": contacts or [], "error": error})
+                if error is None:
+                    return [{"domain": domain, "status": "success", "contacts": contacts or []}]
+                return [{"domain": domain, "status": "error", "message": error}]
+
+            # Checkpointed by domain rather than by position
+            run_batch(task_id, domains, {"total": len(domains), "completed": 0, "failed": 0}, lookup, handle,
+                      checkpoint_key=lambda index: domains[index])
+            update_task_status_and_result(task_id, 'success')
+        except Exception as e:
+            update_task_status_and_result(task_id, 'error', {'message': str(e)})
+
+def generate_emails_batch_task(leads, task_id):
+    with app.app_context():  # Push the application context
+        try:
+            update_task_status_and_result(task_id, 'progressing')
+            workers = int(os.environ.get('EMAIL_BATCH_WORKERS', email_content.EMAIL_MAX_CONCURRENCY))
+
+            def generate(remaining):
+                pending = [(lead["lead_name"], lead["lead_website"]) for lead in remaining]
+                return email_content.generate_outreach_emails(pending, max_workers=workers)
+
+            def handle(index, lead, email, error, summary):
+                row = dict(lead, index=index)
+                if error is None:
+                    row.update(status="success", email_content=email)
+                else:
+                    row.update(status="error", message=error)
+                publish_progress(task_id, 'rows', {"rows": [row]})
+                return [row]
+
+            run_batch(task_id, leads, {"total": len(leads), "completed": 0, "failed": 0}, generate, handle)
+            update_task_status_and_result(task_id, 'success')
+        except Exception as e:
+            update_task_status_and_result(task_id, 'error', {'message': str(e)})
+
+def bulk_search_task(searches, max_pages, use_cache, task_id):
+    with app.app_context():  # Push the application context
+        try:
+            update_task_status_and_result(task_id, 'progressing')
+            workers = int(os.environ.get('BULK_SEARCH_WORKERS', 3))
+
+            def scrape(search):
+                # Runs on the job's worker threads, which need a context of their own for the lead index
+                with app.app_context():
+                    return main.scrape_yellow_pages(search["searchterm"], search["location"], search["leadids"][0],
+                                                    max_pages, use_cache=use_cache,
+                                                    lookup_known=find_known_companies)
+
+            def handle(index, search, rows, error, summary):
+                if error is None:
+                    output = main.fan_out_rows(rows, search["leadids"])
+                    summary["rows"] += len(output)
+                else:
+                    output = []
+                    if len(summary["errors"]) < 100:
+                        summary["errors"].append({"searchterm": search["searchterm"],
+                                                  "location": search["location"], "message": error})
+                publish_progress(task_id, 'progress', {"completed": summary["completed"],
+                                                       "failed": summary["failed"], "rows": summary["rows"],
+                                                       "total": summary["searches"]})
+                if rows:
+                    try:
+                        remember_companies(rows)
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"Could not update the lead index: {e}")
+                return output
+
+            summary = {"searches": len(searches), "leads": sum(len(s["leadids"]) for s in searches),
+                       "completed": 0, "failed": 0, "rows": count_result_rows(task_id), "errors": []}
+            run_batch(task_id, searches, summary,
+                      lambda remaining: main.scrape_yellow_pages_bulk(remaining, max_workers=workers, scrape=scrape),
+                      handle)
+            update_task_status_and_result(task_id, 'success')
         except Exception as e:
             update_task_status_and_result(task_id, 'error', {'message': str(e)})
 
+# Task kind -> (scheduler pool, task function); the kind is stored with the task so it can be resumed
+TASK_KINDS = {
+    'yellowpages': ('yellowpages', scrape_yellow_pages_task),
+    'contacts': ('contacts', find_contacts_task),
+    'contacts_batch': ('contacts', find_contacts_batch_task),
+    'email_batch': ('email', generate_emails_batch_task),
+    'bulk': ('bulk', bulk_search_task),
+}
 
 
-@app.route('/generate_email', methods=['POST'])
+@api.route('/generate_email', methods=['POST'])
 def generate_email():
     data = request.json
     lead_name = data.get('lead_name')
@@ -74,14 +837,47 @@ def generate_email():
     if not lead_name or not lead_website:
         return jsonify({"error": "Missing lead_name or lead_website parameters"}), 200
 
+    if data.get('stream'):
+        # Plain text sent piece by piece as the model writes it, so the first words arrive right away
+        def stream():
+            try:
+                yield from email_content.stream_outreach_email(lead_name, lead_website)
+            except Exception as e:
+                yield f"\n[error] An error occurred during email generation: {str(e)}"
+        return Response(stream_with_context(stream()), mimetype='text/plain')
+
     try:
         # Generate the email content directly without using a separate thread
-        email_content = generate_outreach_email(lead_name, lead_website)
-        return jsonify({"email_content": email_content, "status": "success"}), 200
+        content = email_content.generate_outreach_email(lead_name, lead_website)
+        return jsonify({"email_content": content, "status": "success"}), 200
     except Exception as e:
         return jsonify({"error": f"An error occurred during email generation: {str(e)}"}), 200
 
-@app.route('/company', methods=['POST'])
+@api.route('/generate_email/batch', methods=['POST'])
+def generate_email_batch():
+    data = request.json
+    leads = data.get('leads')
+
+    if not leads or not isinstance(leads, list):
+        return jsonify({"error": "Missing leads list"}), 200
+    if not all(isinstance(lead, dict) and lead.get('lead_name') and lead.get('lead_website') for lead in leads):
+        return jsonify({"error": "Every lead needs a lead_name and a lead_website"}), 200
+
+    max_batch = int(os.environ.get('EMAIL_BATCH_MAX', 1000))
+    if len(leads) > max_batch:
+        return jsonify({"error": f"Too many leads, the limit is {max_batch} per batch"}), 200
+
+    leads = [{"lead_name": lead['lead_name'], "lead_website": lead['lead_website']} for lead in leads]
+    task_id = enqueue_task('email_batch', leads=leads)
+    return jsonify({"task_id": task_id, "leads": len(leads), "message": "Batch email generation task started."}), 200
+
+def parse_flag(value):
+    # JSON booleans as they are; strings from JSON, forms and query strings only when they say yes
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+@api.route('/company', methods=['POST'])
 def company():
     data = request.json
     searchterm = data.get('searchterm')
@@ -91,15 +887,60 @@ def company():
     if not all([searchterm, location, leadid]):
         return jsonify({"error": "Missing parameters"}), 200
 
-    task_id = str(uuid.uuid4())
-    new_task = Task(task_id=task_id, status='progressing')
-    db.session.add(new_task)
-    db.session.commit()
+    try:
+        max_pages = min(int(data.get('max_pages') or 1), int(os.environ.get('YELLOWPAGES_MAX_PAGES', 10)))
+        max_results = int(data['max_results']) if data.get('max_results') else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_pages and max_results must be integers"}), 200
+    if max_results is not None and max_results < 1:
+        return jsonify({"error": "max_results must be at least 1"}), 200
+
+    use_cache = not parse_flag(data.get('bypass_cache'))
 
-    threading.Thread(target=scrape_yellow_pages_task, args=(searchterm, location, leadid, task_id)).start()
+    task_id = enqueue_task('yellowpages', searchterm=searchterm, location=location, leadid=leadid,
+                           max_pages=max(1, max_pages), max_results=max_results, use_cache=use_cache)
     return jsonify({"task_id": task_id, "message": "Scraping task started."}), 200
 
-@app.route('/contacts', methods=['POST'])
+@api.route('/company/bulk', methods=['POST'])
+def company_bulk():
+    """
+    Starts one job for a whole spreadsheet of searches: a CSV (searchterm, location, leadid header) or
+    JSON Lines upload, either as the `file` form field or as the request body.
+    Identical searches are scraped once and their rows copied to every leadid that asked for them.
+    """
+    upload = request.files.get('file')
+    options = request.form if upload else request.args
+    if upload:
+        text = upload.read().decode('utf-8-sig', errors='replace')
+        name = (upload.filename or '').lower()
+    else:
+        text = request.get_data(as_text=True)
+        name = ''
+    fmt = options.get('format') or ('csv' if name.endswith('.csv') or 'csv' in (request.mimetype or '')
+                                    else 'jsonl')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({"error": "format must be csv or jsonl"}), 200
+
+    rows, invalid = main.read_search_rows(text, fmt)
+    if not rows:
+        return jsonify({"error": "No valid rows; every row needs a searchterm, location and leadid",
+                        "invalid_rows": invalid}), 200
+    max_rows = int(os.environ.get('BULK_MAX_ROWS', 20000))
+    if len(rows) > max_rows:
+        return jsonify({"error": f"Too many rows, the limit is {max_rows} per job"}), 200
+
+    try:
+        max_pages = min(int(options.get('max_pages') or 1), int(os.environ.get('YELLOWPAGES_MAX_PAGES', 10)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_pages must be an integer"}), 200
+    use_cache = not parse_flag(options.get('bypass_cache'))
+
+    searches = main.group_searches(rows)
+    task_id = enqueue_task('bulk', searches=searches, max_pages=max(1, max_pages), use_cache=use_cache)
+    return jsonify({"task_id": task_id, "rows": len(rows), "invalid_rows": invalid, "searches": len(searches),
+                    "message": "Bulk scraping job started."}), 200
+
+@api.route('/contacts', methods=['POST'])
 def contacts():
     data = request.json
     website_url = data.get('website')
@@ -107,22 +948,307 @@ def contacts():
     if not website_url:
         return jsonify({"error": "Missing website URL"}), 200
 
-    task_id = str(uuid.uuid4())
-    new_task = Task(task_id=task_id, status='progressing')
-    db.session.add(new_task)
-    db.session.commit()
-
-    threading.Thread(target=find_contacts_task, args=(website_url, task_id)).start()
+    task_id = enqueue_task('contacts', website_url=website_url)
     return jsonify({"task_id": task_id, "message": "Contact finding task started."}), 200
 
-@app.route('/task_status/<task_id>', methods=['GET'])
+@api.route('/contacts/batch', methods=['POST'])
+def contacts_batch():
+    data = request.json
+    websites = data.get('websites')
+
+    if not websites or not isinstance(websites, list):
+        return jsonify({"error": "Missing websites list"}), 200
+    if not all(isinstance(website, str) for website in websites):
+        return jsonify({"error": "Every website must be a string"}), 200
+
+    max_batch = int(os.environ.get('CONTACTS_BATCH_MAX', 1000))
+    domains = main.dedupe_domains(websites)
+    if not domains:
+        return jsonify({"error": "No valid websites provided"}), 200
+    if len(domains) > max_batch:
+        return jsonify({"error": f"Too many websites, the limit is {max_batch} per batch"}), 200
+
+    task_id = enqueue_task('contacts_batch', domains=domains)
+    return jsonify({"task_id": task_id, "domains": len(domains),
+                    "message": "Batch contact finding task started."}), 200
+
+def db_queue_counts():
+    counts = db.session.query(Task.status, db.func.count(Task.id)) \
+        .filter(Task.status.in_(('queued', 'progressing'))).group_by(Task.status).all()
+    return dict({"queued": 0, "progressing": 0}, **{status: count for status, count in counts})
+
+@api.route('/stats', methods=['GET'])
+def stats():
+    cache = response_cache.get_cache()
+    if TASK_BACKEND == 'db':
+        # The pools of this process are idle; the queue lives in the task table
+        tasks = dict(db_queue_counts(), backend="db")
+    else:
+        tasks = scheduler.stats()
+    # Stats of modules nothing has used yet are null rather than importing them just to report zeros
+    pool, emails, finder = loaded(driver_pool), loaded(email_content), loaded(email_finder)
+    return jsonify({"tasks": tasks, "driver_pool": pool.get_pool().stats() if pool else None,
+                    "response_cache": cache.stats() if cache else None,
+                    "email_cache": emails.email_cache.stats() if emails else None,
+                    "contact_lookup": finder.lookup_stats.stats() if finder else None}), 200
+
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus text format: stage timings, event counters, and the current pool and cache state as gauges
+    gauges = {"scraper_tasks_queued": {}, "scraper_tasks_running": {}}
+    for pool_name, pool_stats in scheduler.stats().items():
+        gauges["scraper_tasks_queued"][(("pool", pool_name),)] = pool_stats["queued"]
+        gauges["scraper_tasks_running"][(("pool", pool_name),)] = pool_stats["running"]
+    if TASK_BACKEND == 'db':
+        gauges["scraper_db_tasks"] = {(("status", status),): count for status, count in db_queue_counts().items()}
+    gauges["scraper_contact_singleflight_in_flight"] = {(): contact_lookups.in_flight()}
+    emails = loaded(email_content)
+    gauges["scraper_email_cache_entries"] = {(): emails.email_cache.stats()["entries"] if emails else 0}
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+def poll_task_status(task_id, last_status, wait):
+    """
+    Watches the task's status column until it differs from `last_status` or `wait` seconds pass.
+    Used for tasks running in another worker process, whose events this process never sees.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        status = db.session.query(Task.status).filter_by(task_id=task_id).scalar()
+        db.session.rollback()  # Start a fresh transaction so the next poll sees new commits
+        if status != last_status or time.monotonic() + TASK_EVENTS_DB_POLL > deadline:
+            return status
+        time.sleep(TASK_EVENTS_DB_POLL)
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+def stream_task_events(task_id, since):
+    last_id = since
+    last_status = None
+    started = time.monotonic()
+    while time.monotonic() - started < TASK_EVENTS_MAX_STREAM:
+        if TASK_BACKEND != 'db' and progress_broker.knows(task_id):
+            events, finished = progress_broker.wait(task_id, last_id, TASK_EVENTS_MAX_WAIT)
+            for event in events:
+                last_id = event["id"]
+                yield format_sse(event)
+            if finished:
+                return
+            if events:
+                continue
+        else:
+            status = poll_task_status(task_id, last_status, TASK_EVENTS_MAX_WAIT)
+            if status is None:
+                yield format_sse({"id": last_id, "event": "error", "data": {"error": "Task not found."}})
+                return
+            if status != last_status:
+                last_status = status
+                yield format_sse({"id": last_id, "event": "status", "data": {"status": status}})
+                if status in TERMINAL_STATUSES:
+                    return
+                continue
+        yield ": keep-alive\n\n"
+
+@api.route('/task_events/<task_id>', methods=['GET'])
+def task_events(task_id):
+    """
+    Pushes a task's progress instead of making clients poll /task_status.
+    With `Accept: text/event-stream` this is a server-sent event stream that resumes from `Last-Event-ID`;
+    otherwise it long-polls: it waits up to `wait` seconds for events newer than `since` and returns them as JSON.
+    """
+    since = int(request.args.get('since') or request.headers.get('Last-Event-ID') or 0)
+    wait = min(float(request.args.get('wait', TASK_EVENTS_MAX_WAIT)), TASK_EVENTS_MAX_WAIT)
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return Response(stream_with_context(stream_task_events(task_id, since)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if TASK_BACKEND != 'db' and progress_broker.knows(task_id):
+        events, finished = progress_broker.wait(task_id, since, wait)
+        last_id = events[-1]["id"] if events else since
+        return jsonify({"task_id": task_id, "events": events, "last_event_id": last_id, "finished": finished}), 200
+
+    status = poll_task_status(task_id, request.args.get('status'), wait)
+    if status is None:
+        return jsonify({"error": "Task not found."}), 200
+    return jsonify({"task_id": task_id, "events": [{"id": since, "event": "status", "data": {"status": status}}],
+                    "last_event_id": since, "finished": status in TERMINAL_STATUSES}), 200
+
+def task_status_head(task, offset=0, limit=None):
+    # Every /task_status field but the result, the same whether the response is streamed or not
+    head = {"task_id": task.task_id, "status": task.status,
+            "timings": json.loads(task.timings) if task.timings else None}
+    if offset or limit is not None:
+        head.update(total_rows=count_result_rows(task.task_id), offset=offset, limit=limit)
+    return head
+
+def stream_task_status(task, offset=0, limit=None):
+    """
+    Yields the /task_status document piece by piece, reading the result rows a few batches at a time.
+    """
+    head = task_status_head(task, offset, limit)
+    kind = task_kind(task)
+    if kind in (None, 'bulk') or task.status == 'error':
+        yield json.dumps(dict(head, result=build_task_result(task)))
+        return
+
+    summary = json.loads(task.result) if task.result else {}
+    rows = iter_result_rows(task.task_id, offset, limit)
+    result_start = json.dumps(head)[:-1] + ', "result": '
+    summary_start = json.dumps(summary)[:-1] + (', ' if summary else '')
+    if kind == 'contacts_batch':
+        yield result_start + summary_start + '"domains": {'
+        items = (json.dumps(row["domain"]) + ': ' + json.dumps({key: value for key, value in row.items()
+                                                                if key != "domain"}) for row in rows)
+        end = '}}}'
+    elif kind == 'email_batch':
+        yield result_start + summary_start + '"emails": ['
+        items = (json.dumps(row) for row in rows)
+        end = ']}}'
+    else:
+        yield result_start + '['
+        items = (json.dumps(row) for row in rows)
+        end = ']}'
+
+    first = True
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == 200:
+            yield ('' if first else ',') + ','.join(chunk)
+            first, chunk = False, []
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+    yield end
+
+@api.route('/task_status/<task_id>', methods=['GET'])
 def task_status(task_id):
+    """
+    Query parameters: offset and limit page through the result rows in the order they were saved
+    (for batches, the order the items finished in; email rows carry their lead's `index`);
+    stream=1 sends the same document as it is read from the database instead of building it in memory.
+    """
     task = Task.query.filter_by(task_id=task_id).first()
-    if task:
-        result = json.loads(task.result) if task.result else None  # Deserialize result from JSON string
-        return jsonify({"task_id": task.task_id, "status": task.status, "result": result}), 200
-    else:
+    if not task:
         return jsonify({"error": "Task not found."}), 200
 
+    try:
+        offset = max(0, int(request.args.get('offset') or 0))
+        limit = max(0, int(request.args['limit'])) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 200
+
+    if parse_flag(request.args.get('stream')):
+        return Response(stream_with_context(stream_task_status(task, offset, limit)), mimetype='application/json')
+
+    body = dict(task_status_head(task, offset, limit), result=build_task_result(task, offset, limit))
+    return jsonify(body), 200
+
+def export_value(value):
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+@api.route('/task_export/<task_id>', methods=['GET'])
+def task_export(task_id):
+    """
+    Streams every result row of a task as JSON Lines (default) or CSV, one stored batch at a time.
+    """
+    task = Task.query.filter_by(task_id=task_id).first()
+    if not task:
+        return jsonify({"error": "Task not found."}), 200
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({"error": "format must be csv or jsonl"}), 200
+
+    def generate():
+        columns = None
+        batches = TaskResultBatch.query.filter_by(task_id=task_id).order_by(TaskResultBatch.seq).yield_per(20)
+        for batch in batches:
+            rows = batch_rows(batch)
+            if fmt == 'jsonl':
+                yield ''.join(json.dumps(row) + '\n' for row in rows)
+                continue
+            buffer = io.StringIO()
+            if columns is None and rows:
+                columns = list(rows[0])  # The first row's fields make up the header
+                csv.writer(buffer).writerow(columns)
+            writer = csv.DictWriter(buffer, columns or [], extrasaction='ignore')
+            for row in rows:
+                writer.writerow({key: export_value(value) for key, value in row.items()})
+            yield buffer.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    headers = {'Content-Disposition': f'attachment; filename="{task_id}.{fmt}"', 'X-Task-Status': task.status}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+@api.route('/task_resume/<task_id>', methods=['POST'])
+def task_resume(task_id):
+    """
+    Re-queues a task that failed or was orphaned by a restart. Batch tasks skip the domains they already finished.
+    A task whose lease has not run out is still queued or running in some process and is refused,
+    since a second copy would write the same rows.
+    """
+    task = Task.query.filter_by(task_id=task_id).first()
+    if not task:
+        return jsonify({"error": "Task not found."}), 200
+    if task.status == 'success' or not task.params:
+        return jsonify({"error": "Task cannot be resumed."}), 200
+
+    # Conditional, so of a resume and a process claiming or renewing the task at the same moment only one wins.
+    # With the thread backend this process takes the lease in the same statement, for the pool it submits to
+    params = json.loads(task.params)
+    previous_status = task.status
+    now = datetime.utcnow()
+    owner = lease_values(process_id()) if TASK_BACKEND != 'db' else {"worker_id": None, "lease_expires_at": None}
+    requeued = Task.query.filter(Task.task_id == task_id, Task.status != 'success',
+                                 or_(Task.worker_id.is_(None), Task.lease_expires_at.is_(None),
+                                     Task.lease_expires_at < now)) \
+        .update(dict(owner, status='queued', queued_at=now, attempts=0), synchronize_session=False)
+    db.session.commit()
+    if not requeued:
+        return jsonify({"error": "Task is still running."}), 200
+    publish_progress(task_id, 'status', {"status": 'queued'})
+
+    try:
+        submit_task(task_id, params["kind"], params["args"])
+    except QueueFullError:
+        Task.query.filter_by(task_id=task_id) \
+            .update({"status": previous_status, "worker_id": None, "lease_expires_at": None},
+                    synchronize_session=False)
+        db.session.commit()
+        publish_progress(task_id, 'status', {"status": previous_status})
+        raise
+    return jsonify({"task_id": task_id, "message": "Task resumed."}), 200
+
+def create_app():
+    """
+    Builds the Flask app: configuration, CORS, the database and the API routes, with the schema brought up to date.
+    It opens no long-lived connections and starts no threads, so it is safe to run in the gunicorn master
+    with --preload: the schema check then runs once instead of once per worker.
+    """
+    app = Flask(__name__)
+
+    # Enable CORS
+    CORS(app)
+
+    # Database configuration
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url.startswith('postgres://'):
+        database_url = database_url.replace("://", "ql://", 1)  # Heroku DATABASE_URL fix
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Larger bodies (e.g. /company/bulk uploads) are refused with a 413 before they are read
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 16)) * 1024 * 1024
+    db.init_app(app)
+    app.register_blueprint(api)
+
+    with app.app_context():
+        ensure_schema()
+        # Forked workers must not share the master's pooled connections
+        db.engine.dispose()
+    return app
+
+# The app gunicorn serves (app:app); background tasks and worker.py push its context
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True)
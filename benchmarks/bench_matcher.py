@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of business name matching: per-title cost of the original normalize-per-call
+functions against utils.NameMatcher, on the titles of the saved search page plus generated variants.
+
+    python benchmarks/bench_matcher.py [--titles 20000] [--search-term "acme plumbing"]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils import NameMatcher, normalize_string, remove_word
+from yellowpages_scraper import parse_search_page
+
+
+def original_normalize_string(s):
+    # The implementation before NameMatcher, kept here as the reference and the baseline
+    legal_entities = ['llc', 'inc', 'ltd', 'corporation', 'corp', 'lp']
+    s = s.lower().replace('&', 'and').replace('.', '').replace(',', '')
+    for entity in legal_entities:
+        s = s.replace(entity, '')
+    s = ''.join(char for char in s if char.isalnum() or char.isspace())
+    s = ' '.join(s.split())
+    return s
+
+
+def original_contains_all_search_terms(title, search_term):
+    title_normalized = original_normalize_string(title)
+    search_terms_lower = original_normalize_string(search_term).split()
+    return all(word in title_normalized for word in search_terms_lower)
+
+
+def original_remove_word(original_string, word_to_remove):
+    pattern = r'\b' + re.escape(word_to_remove) + r'\b'
+    return re.sub(pattern, '', original_string, flags=re.IGNORECASE).strip()
+
+
+def load_titles(count):
+    with open(os.path.join(ROOT, 'benchmarks', 'fixtures', 'search_results.html'), encoding='utf-8') as f:
+        base = [result.find("a", class_="business-name").text.strip() for result in parse_search_page(f.read())]
+    suffixes = ['', ' LLC', ' Inc.', ', Corp', ' & Sons', ' - CLOSED', ' Co.', ' Ltd']
+    random.seed(42)
+    # A third of the titles repeat, as they do across overlapping searches
+    titles = [f"{random.choice(base)}{random.choice(suffixes)} {random.randint(1, count // 3)}" for _ in range(count)]
+    return titles
+
+
+def per_title_us(fn, titles):
+    started = time.perf_counter()
+    fn(titles)
+    return (time.perf_counter() - started) / len(titles) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Name matching micro-benchmark")
+    parser.add_argument('--titles', type=int, default=20000)
+    parser.add_argument('--search-term', default="acme plumbing")
+    args = parser.parse_args()
+
+    titles = load_titles(args.titles)
+    matcher = NameMatcher(args.search_term)
+
+    expected = [original_contains_all_search_terms(title, args.search_term) for title in titles]
+    assert matcher.match_batch(titles) == expected, "NameMatcher disagrees with contains_all_search_terms"
+    assert all(normalize_string(title) == original_normalize_string(title) for title in titles)
+    assert all(remove_word(title, "- CLOSED") == original_remove_word(title, "- CLOSED") for title in titles)
+    normalize_string.cache_clear()
+
+    cases = [
+        ("original contains_all_search_terms",
+         lambda ts: [original_contains_all_search_terms(t, args.search_term) for t in ts]),
+        ("NameMatcher.match_batch (cold cache)", matcher.match_batch),
+        ("NameMatcher.match_batch (warm cache)", matcher.match_batch),
+        ("original remove_word", lambda ts: [original_remove_word(t, "- CLOSED") for t in ts]),
+        ("remove_word (cached pattern)", lambda ts: [remove_word(t, "- CLOSED") for t in ts]),
+        ("NameMatcher.score_batch (fuzzy)", matcher.score_batch),
+    ]
+    for label, fn in cases:
+        print(f"{label:40} {per_title_us(fn, titles):8.2f} us/title")
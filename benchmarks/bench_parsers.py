@@ -0,0 +1,107 @@
+"""
+Compares the HTML parsing paths used by the scrapers on the saved pages in benchmarks/fixtures.
+
+Every parser is first checked to extract exactly the same fields as the original
+full-document html.parser path, then timed. Reports pages/sec and peak memory per parser.
+
+    python benchmarks/bench_parsers.py [--iterations 50] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from yellowpages_scraper import parse_search_page, parse_listing, apply_detail_page
+from email_finder import parse_table_rows
+
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+# (label, parser, strained); the first entry is the reference the others must match
+PARSERS = [
+    ("html.parser (full tree)", "html.parser", False),
+    ("html.parser + strainer", "html.parser", True),
+    ("lxml (full tree)", "lxml", False),
+    ("lxml + strainer", "lxml", True),
+]
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def empty_listing():
+    return {"title": None, "phone_number": None, "full_address": None, "website_url": None,
+            "city": None, "state": None, "zip_code": None, "detail_url": None}
+
+
+def extract(pages, parser, strained):
+    listings = []
+    for result in parse_search_page(pages['search'], parser, strained):
+        try:
+            listings.append(parse_listing(result))
+        except Exception as e:
+            listings.append({"error": type(e).__name__})
+    detail = apply_detail_page(empty_listing(), pages['detail'], parser, strained)
+    table = parse_table_rows(pages['table'], parser, strained)
+    return {"search": listings, "detail": detail, "table": table}
+
+
+def parser_available(parser):
+    try:
+        from bs4 import BeautifulSoup
+        BeautifulSoup("<p></p>", parser)
+        return True
+    except Exception:
+        return False
+
+
+def run(iterations):
+    pages = {"search": load('search_results.html'), "detail": load('listing_detail.html'),
+             "table": load('emailbydomain_results.html')}
+    reference = extract(pages, *PARSERS[0][1:])
+    results = []
+
+    for label, parser, strained in PARSERS:
+        if not parser_available(parser):
+            print(f"{label:28} skipped, parser not installed")
+            continue
+        identical = extract(pages, parser, strained) == reference
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            extract(pages, parser, strained)
+        elapsed = time.perf_counter() - started
+
+        # Measured on a separate pass because tracing allocations slows parsing down several times
+        tracemalloc.start()
+        extract(pages, parser, strained)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        row = {"parser": label, "identical": identical,
+               "pages_per_sec": round(iterations * len(pages) / elapsed, 1),
+               "peak_kib": round(peak / 1024)}
+        results.append(row)
+        print(f"{label:28} {row['pages_per_sec']:>9} pages/s {row['peak_kib']:>8} KiB peak"
+              f"   {'identical' if identical else 'OUTPUT DIFFERS'}")
+    return results
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    argparser.add_argument('--iterations', type=int, default=50)
+    argparser.add_argument('--json', help="Also write the results to this file")
+    args = argparser.parse_args()
+
+    results = run(args.iterations)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not all(row["identical"] for row in results):
+        sys.exit(1)
@@ -0,0 +1,205 @@
+"""
+Offline end-to-end benchmark of the scraping pipeline against the local stand-in server.
+
+Drives main.scrape_yellow_pages, main.find_contacts (Chrome only with CONTACT_LOOKUP_MODE=selenium), email_content.generate_outreach_email
+and the Flask endpoints in app.py at the requested concurrency, then reports throughput, p50/p95/p99 task latency
+and peak RSS. Results are written as JSON under benchmarks/results/ so runs can be compared.
+
+    python benchmarks/bench_pipeline.py --scenario yellowpages api --jobs 40 --concurrency 8 \
+        --latency-ms 50 --error-rate 0.01 [--baseline benchmarks/results/previous.json]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standin_server import StandInServer
+
+SCENARIOS = ['yellowpages', 'contacts', 'email', 'api']
+
+
+def configure_environment(server_url, args, workdir):
+    # The scraper modules read these at import time, so they are set before anything is imported
+    os.environ['YELLOWPAGES_BASE_URL'] = server_url
+    os.environ['EMAIL_FINDER_URL'] = f"{server_url}/emailbydomain/"
+    os.environ['OPENAI_API_BASE'] = f"{server_url}/v1"
+    os.environ.setdefault('OPENAI_API_KEY', 'stand-in')
+    os.environ['YELLOWPAGES_RATE'] = str(args.rate)
+    os.environ['YELLOWPAGES_BURST'] = str(max(1, int(args.rate)))
+    os.environ['RESPONSE_CACHE_PATH'] = os.path.join(workdir, 'response_cache.sqlite3')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.sqlite3')}")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)], 3)
+
+
+def measure(job, jobs, concurrency):
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        started = time.perf_counter()
+        ok = job(i)
+        return ok, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(timed, i) for i in range(jobs)]:
+            try:
+                ok, latency = future.result()
+            except Exception as e:
+                print(f"Job failed: {e}")
+                ok, latency = False, None
+            if latency is not None:
+                latencies.append(latency)
+            errors += 0 if ok else 1
+    wall = time.perf_counter() - started
+
+    return {
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(jobs / wall, 3),
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+    }
+
+
+def yellowpages_job(args):
+    import main
+
+    def job(i):
+        result = main.scrape_yellow_pages("acme plumbing", "Springfield, IL", i + 1, max_pages=args.pages,
+                                          use_cache=args.cache)
+        return bool(result)
+    return job
+
+
+def contacts_job(args):
+    import main
+
+    def job(i):
+        return main.find_contacts(f"acmeplumbing{i}.com") is not None
+    return job
+
+
+def email_job(args):
+    import email_content
+
+    def job(i):
+        # Every other job repeats an earlier lead, which the email cache answers without a request
+        return bool(email_content.generate_outreach_email(f"Acme Plumbing {i // 2}", f"acmeplumbing{i // 2}.com"))
+    return job
+
+
+def api_job(args):
+    import app
+
+    def job(i):
+        client = app.app.test_client()
+        response = client.post('/company', json={"searchterm": "acme plumbing", "location": "Springfield, IL",
+                                                 "leadid": i + 1, "max_pages": args.pages,
+                                                 "bypass_cache": not args.cache})
+        if response.status_code != 200 or "task_id" not in response.json:
+            return False
+        task_id = response.json["task_id"]
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            status = client.get(f'/task_status/{task_id}').json.get("status")
+            if status in ('success', 'error'):
+                return status == 'success'
+            time.sleep(args.poll_interval)
+        return False
+    return job
+
+
+JOBS = {"yellowpages": yellowpages_job, "contacts": contacts_job, "email": email_job, "api": api_job}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for key in ("throughput_per_s", "p95_s"):
+            if previous.get(key):
+                change = (current[key] - previous[key]) / previous[key] * 100
+                print(f"{name:12} {key:18} {previous[key]:>9} -> {current[key]:>9} ({change:+.1f}%)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=['yellowpages', 'api'])
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=2, help="Result pages per search")
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=200, help="Per-host request rate limit during the run")
+    parser.add_argument('--cache', action='store_true', help="Use the response cache instead of bypassing it")
+    parser.add_argument('--timeout', type=float, default=120, help="Per-task timeout for the api scenario")
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--output', help="Results file, defaults to benchmarks/results/pipeline-<timestamp>.json")
+    parser.add_argument('--baseline', help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-pipeline-')
+    server = StandInServer(latency_ms=args.latency_ms, error_rate=args.error_rate, pages=args.pages).start()
+    configure_environment(server.url, args, workdir)
+
+    results = {}
+    for name in args.scenario:
+        print(f"Running {name} ({args.jobs} jobs, concurrency {args.concurrency})...")
+        results[name] = measure(JOBS[name](args), args.jobs, args.concurrency)
+        print(json.dumps(results[name], indent=2))
+
+    report = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "standin_requests": server.requests,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_child_rss_kib": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Peak RSS {report['peak_rss_kib']} KiB, results written to {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,114 @@
+"""
+Startup benchmark of the web process: how long `import app` takes and how much memory each gunicorn worker holds.
+
+Every run is a fresh interpreter against a throwaway SQLite database, in one of three modes:
+  eager    imports main, email_content, driver_pool and email_finder before app, as app.py used to at load time
+  lazy     imports app only; the scraping modules stay unloaded until a task or route needs them
+  preload  imports app in a parent and forks a worker from it, as gunicorn --preload does; "private MB" is
+           the memory only that worker holds, i.e. what every additional worker costs
+
+Each mode also serves one GET /task_status request and reports which heavy libraries ended up loaded.
+
+    python benchmarks/bench_startup.py [--runs 5] [--mode eager lazy preload]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ['eager', 'lazy', 'preload']
+HEAVY_MODULES = ['selenium', 'fake_useragent', 'bs4', 'lxml', 'openai', 'aiohttp', 'fuzzywuzzy']
+
+PROBE = r'''
+import json, os, resource, sys, time
+sys.path.insert(0, ROOT)
+HEAVY_MODULES, MODE = HEAVY_MODULES, MODE
+
+def memory_mb():
+    # Resident and private (not shared with the parent) memory of this process, from /proc when available
+    rss = private = None
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.endswith('kB\n')}
+        rss = fields['Rss'] / 1024
+        private = (fields['Private_Clean'] + fields['Private_Dirty']) / 1024
+    except (OSError, KeyError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rss, private
+
+def serve_one(app_module, imported):
+    started = time.perf_counter()
+    status = app_module.app.test_client().get('/task_status/does-not-exist').status_code
+    rss, private = memory_mb()
+    return {"import_seconds": imported, "first_request_seconds": time.perf_counter() - started,
+            "status": status, "rss_mb": rss, "private_mb": private,
+            "heavy_loaded": [name for name in HEAVY_MODULES if name in sys.modules]}
+
+started = time.perf_counter()
+if MODE == 'eager':
+    import main, email_content, driver_pool, email_finder
+import app
+imported = time.perf_counter() - started
+
+if MODE == 'preload':
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        # The engine was disposed by create_app, so the worker opens its own connection
+        os.write(write_end, json.dumps(serve_one(app, imported)).encode())
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as f:
+        result = json.loads(f.read())
+    os.waitpid(pid, 0)
+else:
+    result = serve_one(app, imported)
+print(json.dumps(result))
+'''
+
+
+def run_probe(mode, workdir, run):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, f'startup-{mode}-{run}.db')}",
+               RESPONSE_CACHE_PATH=os.path.join(workdir, 'response_cache.sqlite3'))
+    source = f"ROOT = {ROOT!r}\nHEAVY_MODULES = {HEAVY_MODULES!r}\nMODE = {mode!r}\n" + PROBE
+    output = subprocess.run([sys.executable, '-c', source], env=env, cwd=workdir,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(results):
+    def median(key):
+        values = [r[key] for r in results if r[key] is not None]
+        return statistics.median(values) if values else None
+    return {"import_seconds": median("import_seconds"), "first_request_seconds": median("first_request_seconds"),
+            "rss_mb": median("rss_mb"), "private_mb": median("private_mb"),
+            "heavy_loaded": results[-1]["heavy_loaded"], "status": results[-1]["status"]}
+
+
+def format_value(value, spec):
+    return format(value, spec) if value is not None else '-'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Web process import time and per-worker memory")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--mode', nargs='+', choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    if 'preload' in args.mode and not hasattr(os, 'fork'):
+        parser.error("the preload mode needs os.fork")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        summaries = {mode: summarize([run_probe(mode, workdir, run) for run in range(args.runs)])
+                     for mode in args.mode}
+
+    print(f"{'mode':<8} {'import s':>9} {'1st req s':>10} {'RSS MB':>8} {'private MB':>11}  heavy modules loaded")
+    for mode, s in summaries.items():
+        print(f"{mode:<8} {format_value(s['import_seconds'], '9.3f')} {format_value(s['first_request_seconds'], '10.3f')} "
+              f"{format_value(s['rss_mb'], '8.1f')} {format_value(s['private_mb'], '11.1f')}  "
+              f"{', '.join(s['heavy_loaded']) or 'none'}")
@@ -0,0 +1,179 @@
+"""
+Local stand-in for yellowpages.com, emailbydomain.com and the OpenAI chat completion API,
+serving the recorded pages in benchmarks/fixtures.
+
+    /search?...&page=N        search results for pages 1..--pages, an empty results page after that
+    /<city>/mip/<listing>     listing detail page
+    /emailbydomain/           GET: lookup form, POST: results table (the form itself posts to /)
+    /v1/chat/completions      POST: a canned outreach email, streamed when the request asks for it
+
+fail_next() and reject_lead() make chosen requests fail, for the tests of the retry and error handling.
+
+Run it on its own and point the scrapers at it with
+YELLOWPAGES_BASE_URL=http://127.0.0.1:8765, EMAIL_FINDER_URL=http://127.0.0.1:8765/emailbydomain/
+and OPENAI_API_BASE=http://127.0.0.1:8765/v1
+
+    python benchmarks/standin_server.py [--port 8765] [--latency-ms 50] [--error-rate 0.01]
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+EMPTY_SEARCH_PAGE = "<html><body><div class=\"search-results organic\"></div></body></html>"
+EMAIL_TEMPLATE = ("Subject: Lower energy costs for {lead}\n\nHi {lead} team,\n\nNational Utilisource supplies "
+                  "large-scale energy to businesses like yours. Could we set up a short call this week?\n\nBest regards")
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server_version = "StandIn/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.body = b''
+        self._respond()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length)
+        self._respond()
+
+    def _respond(self):
+        config = self.server.config
+        self.server.count_request()
+        latency = config["latency"]
+        if latency:
+            time.sleep(random.uniform(latency * 0.5, latency * 1.5))
+        failure = self.server.take_failure()
+        if failure:
+            status, headers = failure
+            return self._send(status, json.dumps({"error": {"message": "Stand-in failure", "type": "requests"}}),
+                              headers, content_type='application/json')
+        if config["error_rate"] and random.random() < config["error_rate"]:
+            return self._send(503, "Service Unavailable", {'Retry-After': '1'})
+
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path == '/search':
+            page = int(urllib.parse.parse_qs(parts.query).get('page', ['1'])[0])
+            return self._send(200, self.server.search_page(page))
+        if '/mip/' in parts.path:
+            return self._send(200, self.server.pages['detail'])
+        if parts.path.startswith('/emailbydomain') or (parts.path == '/' and self.command == 'POST'):
+            return self._send(200, self.server.pages['results' if self.command == 'POST' else 'form'])
+        if parts.path == '/v1/chat/completions' and self.command == 'POST':
+            return self._complete(json.loads(self.body or b'{}'))
+        return self._send(404, "Not Found")
+
+    def _complete(self, payload):
+        prompt = payload.get("messages", [{}])[-1].get("content", "")
+        lead = prompt.split('"')[1] if prompt.count('"') >= 2 else "there"
+        if lead in self.server.rejected_leads:
+            return self._send(400, json.dumps({"error": {"message": f"Rejected lead {lead}",
+                                                         "type": "invalid_request_error"}}),
+                              content_type='application/json')
+        email = EMAIL_TEMPLATE.format(lead=lead)
+        if not payload.get("stream"):
+            body = {"id": "chatcmpl-standin", "object": "chat.completion", "created": int(time.time()),
+                    "model": payload.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": email},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(email.split()),
+                              "total_tokens": len(prompt.split()) + len(email.split())}}
+            return self._send(200, json.dumps(body), content_type='application/json')
+
+        # Server-sent events, one chunk per word, like the real streaming API
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for word in email.split(' '):
+            chunk = {"id": "chatcmpl-standin", "object": "chat.completion.chunk", "model": payload.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": word + ' '}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _send(self, status, body, headers=None, content_type='text/html; charset=utf-8'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency_ms=0, error_rate=0.0, pages=2):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.config = {"latency": latency_ms / 1000.0, "error_rate": error_rate, "pages": pages}
+        self.pages = {"search": load('search_results.html'), "detail": load('listing_detail.html'),
+                      "form": load('emailbydomain_form.html'), "results": load('emailbydomain_results.html')}
+        self.requests = 0
+        self.rejected_leads = set()
+        self._failures = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def fail_next(self, count, status=503, retry_after='1'):
+        """
+        Answers the next `count` requests, whatever their path, with `status`.
+        :param retry_after: Retry-After header value; None to leave it out.
+        """
+        headers = {'Retry-After': retry_after} if retry_after is not None else {}
+        with self._lock:
+            self._failures.extend([(status, headers)] * count)
+
+    def take_failure(self):
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def reject_lead(self, lead_name):
+        # Completions for this lead get a 400 invalid request error, which is not worth retrying
+        self.rejected_leads.add(lead_name)
+
+    def search_page(self, page):
+        if page > self.config["pages"]:
+            return EMPTY_SEARCH_PAGE
+        if page == 1:
+            return self.pages["search"]
+        # Later pages list different businesses so they survive deduplication
+        return self.pages["search"].replace("Heating ", f"Heating {page}-").replace("555-", f"5{page}5-")
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for yellowpages.com and emailbydomain.com")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--pages', type=int, default=2, help="Number of search result pages that have results")
+    args = parser.parse_args()
+
+    server = StandInServer(args.port, args.latency_ms, args.error_rate, args.pages)
+    print(f"Serving stand-in pages on {server.url}")
+    server.serve_forever()
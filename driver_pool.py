@@ -0,0 +1,183 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+import metrics
+
+# Resource types the emailbydomain page does not need to fill in its form and render the results table
+BLOCKED_RESOURCES = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.webp", "*.ico",
+                     "*.woff", "*.woff2", "*.ttf", "*.otf", "*.css"]
+
+
+def build_chrome_options(lightweight=False):
+    chrome_options = Options()
+    chrome_options.binary_location = os.getenv('GOOGLE_CHROME_BIN')
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    if lightweight:
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.stylesheets": 2,
+            "profile.managed_default_content_settings.fonts": 2,
+        })
+    return chrome_options
+
+
+def create_driver(lightweight=False):
+    # Initialize the Service with the path to ChromeDriver
+    service = Service(executable_path=os.getenv('CHROMEDRIVER_PATH'))
+    with metrics.timer('chrome_startup'):
+        driver = webdriver.Chrome(service=service, options=build_chrome_options(lightweight))
+    if lightweight:
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_RESOURCES})
+        except Exception as e:
+            print(f"Could not enable resource blocking: {e}")
+    return driver
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+
+
+class DriverPool:
+    """
+    Keeps up to `size` headless Chrome sessions alive and lends them out one at a time.
+    A driver is checked before it is lent out, and is replaced after `max_uses` checkouts
+    or as soon as it fails a health check or a borrower raises while holding it.
+    :param size: Maximum number of Chrome sessions alive at once.
+    :param max_uses: Number of checkouts after which a driver is recycled.
+    :param lightweight: Block images, fonts and CSS to cut page load time.
+    """
+
+    def __init__(self, size=2, max_uses=50, lightweight=True):
+        self.size = max(1, size)
+        self.max_uses = max(1, max_uses)
+        self.lightweight = lightweight
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._creations = 0
+        self._recycled = 0
+        self._checkouts = 0
+        self._total_wait = 0.0
+
+    @contextmanager
+    def driver(self):
+        """
+        Borrows a driver for the duration of the `with` block.
+        """
+        started = time.monotonic()
+        self._slots.acquire()
+        try:
+            pooled = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        waited = time.monotonic() - started
+        metrics.observe('chrome_checkout_wait', waited)
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += waited
+
+        healthy = False
+        try:
+            yield pooled.driver
+            healthy = True
+        finally:
+            pooled.uses += 1
+            if healthy and pooled.uses < self.max_uses:
+                self._idle.put(pooled)
+            else:
+                self._discard(pooled)
+            self._slots.release()
+
+    def warm(self, count=None):
+        """
+        Starts drivers ahead of time so the first requests do not pay for Chrome startup.
+        """
+        count = self.size if count is None else min(count, self.size)
+        while self._idle.qsize() < count:
+            self._idle.put(self._create())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "hits": self._hits,
+                "creations": self._creations,
+                "recycled": self._recycled,
+                "checkouts": self._checkouts,
+                "avg_checkout_wait": self._total_wait / self._checkouts if self._checkouts else 0.0,
+            }
+
+    def close(self):
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(pooled)
+
+    def _checkout(self):
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return self._create()
+            if self._is_healthy(pooled.driver):
+                with self._lock:
+                    self._hits += 1
+                return pooled
+            self._discard(pooled)
+
+    def _create(self):
+        driver = create_driver(self.lightweight)
+        with self._lock:
+            self._creations += 1
+        return _PooledDriver(driver)
+
+    def _discard(self, pooled):
+        with self._lock:
+            self._recycled += 1
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"Error while closing a Chrome session: {e}")
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            driver.current_url  # Raises if the browser or chromedriver has died
+            return True
+        except Exception:
+            return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process-wide driver pool, creating it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DriverPool(size=int(os.getenv('CHROME_POOL_SIZE', 2)),
+                               max_uses=int(os.getenv('CHROME_MAX_USES', 50)),
+                               lightweight=os.getenv('CHROME_LIGHTWEIGHT', '1') == '1')
+        return _pool
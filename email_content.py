@@ -1,20 +1,173 @@
 import openai
 import os
-# Load configuration from the JSON file
-def generate_outreach_email(lead_name, lead_website):
-    # Set your OpenAI API key here. Consider using environment variables for production
-    openai.api_key = os.getenv('OPENAI_API_KEY')
-    
-    prompt = f"""Lead information: ["{lead_name}","{lead_website}"]
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib3.util.retry import Retry
+from http_client import PooledSession
+from singleflight import SingleFlight
+import metrics
+
+EMAIL_MODEL = os.getenv('EMAIL_MODEL', "gpt-3.5-turbo")
+EMAIL_MAX_CONCURRENCY = int(os.getenv('EMAIL_MAX_CONCURRENCY', 8))
+EMAIL_MAX_RETRIES = int(os.getenv('EMAIL_MAX_RETRIES', 5))
+EMAIL_REQUEST_TIMEOUT = float(os.getenv('EMAIL_REQUEST_TIMEOUT', 60))
+EMAIL_CACHE_SIZE = int(os.getenv('EMAIL_CACHE_SIZE', 2048))
+
+SYSTEM_PROMPT = "You are a Sales Representative. Draft an initial outreach email to a potential lead based on the provided details."
+PROMPT_TEMPLATE = """Lead information: ["{lead_name}","{lead_website}"]
                 Product/service details: "National Utilisource is one of the leading North American providers of top-rated energy supply to consumers looking for large-scale energy consumption."""
-    messages = [
-        {"role": "system", "content": "You are a Sales Representative. Draft an initial outreach email to a potential lead based on the provided details."},
+
+# Errors worth another attempt; anything else (bad key, invalid request) fails straight away
+RETRYABLE_ERRORS = (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.APIError,
+                    openai.error.Timeout, openai.error.APIConnectionError, openai.error.TryAgain)
+
+
+def configure_client():
+    """
+    Sets the OpenAI client up once per process: key, endpoint, and one pooled HTTP session
+    shared by every thread instead of a new connection per thread.
+    The session only retries failed connections; rate limits are retried by create_completion.
+    """
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    openai.api_base = os.getenv('OPENAI_API_BASE', openai.api_base)
+    openai.requestssession = PooledSession(retry=Retry(total=2, connect=2, read=0, status=0),
+                                           pool_maxsize=EMAIL_MAX_CONCURRENCY)
+
+
+configure_client()
+
+
+class EmailCache:
+    """
+    Thread-safe LRU cache of generated emails keyed by (lead_name, lead_website, template).
+    :param max_entries: Least recently used emails are dropped beyond this many.
+    """
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, email):
+        with self._lock:
+            self._entries[key] = email
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+email_cache = EmailCache(EMAIL_CACHE_SIZE)
+# Bounds the completion requests in flight across every request handler and batch of the process
+api_slots = threading.BoundedSemaphore(EMAIL_MAX_CONCURRENCY)
+# Identical leads generated at the same time share one completion request
+generations = SingleFlight()
+
+
+def build_messages(lead_name, lead_website, template=PROMPT_TEMPLATE):
+    prompt = template.format(lead_name=lead_name, lead_website=lead_website)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": prompt}
     ]
 
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=messages
-    )
 
-    return response.choices[0].message['content']
+def retry_delay(error, attempt):
+    # The server's Retry-After wins; otherwise exponential backoff with jitter, capped at 30 seconds
+    retry_after = getattr(error, 'headers', {}).get('retry-after')
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def create_completion(messages, stream=False):
+    """
+    Calls the chat completion API, retrying rate limits and transient errors with backoff.
+    A streamed response is read after this returns, so the caller holds the api slot for it instead.
+    """
+    for attempt in range(EMAIL_MAX_RETRIES + 1):
+        try:
+            with nullcontext() if stream else api_slots, metrics.timer('email_completion'):
+                return openai.ChatCompletion.create(model=EMAIL_MODEL, messages=messages, stream=stream,
+                                                    request_timeout=EMAIL_REQUEST_TIMEOUT)
+        except RETRYABLE_ERRORS as e:
+            metrics.inc('email_completion_retry', error=type(e).__name__)
+            if attempt == EMAIL_MAX_RETRIES:
+                raise
+            delay = retry_delay(e, attempt)
+            print(f"Email generation failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def generate_outreach_email(lead_name, lead_website, template=PROMPT_TEMPLATE):
+    key = (lead_name, lead_website, template)
+    email = email_cache.get(key)
+    if email is not None:
+        metrics.inc('email_cache_hit')
+        return email
+
+    def generate():
+        response = create_completion(build_messages(lead_name, lead_website, template))
+        content = response.choices[0].message['content']
+        email_cache.put(key, content)
+        return content
+
+    return generations.do(key, generate)
+
+
+def stream_outreach_email(lead_name, lead_website, template=PROMPT_TEMPLATE):
+    """
+    Yields the email text in pieces as the API produces them; the whole email is cached at the end.
+    A cached email is yielded in one piece.
+    """
+    key = (lead_name, lead_website, template)
+    email = email_cache.get(key)
+    if email is not None:
+        yield email
+        return
+
+    parts = []
+    with api_slots:
+        for chunk in create_completion(build_messages(lead_name, lead_website, template), stream=True):
+            content = chunk.choices[0].delta.get('content')
+            if content:
+                parts.append(content)
+                yield content
+    email_cache.put(key, ''.join(parts))
+
+
+def generate_outreach_emails(leads, max_workers=4, template=PROMPT_TEMPLATE):
+    """
+    Generates emails for many leads concurrently and yields (index, email, error) as each one finishes.
+    A failure on one lead is reported for that lead only.
+    :param leads: A list of (lead_name, lead_website) pairs.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(metrics.propagate(generate_outreach_email), name, website, template): index
+                   for index, (name, website) in enumerate(leads)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result(), None
+            except Exception as e:
+                print(f"An error occurred while generating the email for lead {index}: {e}")
+                yield index, None, str(e)
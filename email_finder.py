@@ -1,12 +1,178 @@
 from selenium import webdriver
-from bs4 import BeautifulSoup
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
+import os
 import random
+import threading
+import time
+import urllib.parse
+import requests
+from driver_pool import get_pool
+from html_parsing import make_soup, TABLES, FORMS
+from http_client import get_session
+from utils import random_user_agent
+import metrics
+
+# auto: plain HTTP form submission, Selenium only when that does not produce the table
+# http / selenium: that path only
+CONTACT_LOOKUP_MODE = os.getenv('CONTACT_LOOKUP_MODE', 'auto')
+
+
+class NeedsBrowser(Exception):
+    """
+    The HTTP lookup got a page it cannot use (no form, no results table, an error status),
+    so the lookup has to go through Chrome.
+    """
+
+
+class LookupStats:
+    """
+    Per-mode counters of contact lookups: how many ran, succeeded, failed or fell back, and how long they took.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes = {}
+
+    def record(self, mode, outcome, seconds):
+        with self._lock:
+            counters = self._modes.setdefault(mode, {"attempts": 0, "successes": 0, "failures": 0, "fallbacks": 0,
+                                                     "total_seconds": 0.0})
+            counters["attempts"] += 1
+            counters[outcome] += 1
+            counters["total_seconds"] += seconds
+        metrics.observe(f'contact_lookup_{mode}', seconds)
+        metrics.inc('contact_lookup', mode=mode, outcome=outcome)
+
+    def stats(self):
+        with self._lock:
+            return {mode: dict(counters, avg_seconds=round(counters["total_seconds"] / counters["attempts"], 3),
+                               total_seconds=round(counters["total_seconds"], 3))
+                    for mode, counters in self._modes.items()}
+
+
+lookup_stats = LookupStats()
+
+
+def parse_table_rows(table_html, parser=None, strained=None):
+    """
+    Reads the emailbydomain results table.
+    :return: One list of cell texts per row, without the header row and rows that are all 'Not Found'.
+    """
+    soup = make_soup(table_html, TABLES, parser, strained)
+    table_rows = soup.find_all('tr')
+
+    rows = []
+    for i, row in enumerate(table_rows):
+        if i == 0:  # Skip the header row
+            continue
+        cols = row.find_all(['th', 'td'])
+        row_data = [ele.text.strip() for ele in cols]
+        if row_data and not all(col == 'Not Found' for col in row_data):
+            rows.append(row_data)
+    return rows
+
+def build_form_request(form_html, page_url, domain_name):
+    """
+    Fills in the lookup form the way the browser would: every named field it carries (hidden tokens included),
+    the domain in the url field and the Find Email button.
+    :return: (method, action_url, fields), or None if the page has no lookup form.
+    """
+    soup = make_soup(form_html, FORMS)
+    url_input = soup.find('input', id='url')
+    form = url_input.find_parent('form') if url_input else None
+    if form is None:
+        return None
+
+    fields = {}
+    for element in form.find_all(['input', 'select', 'textarea']):
+        name = element.get('name')
+        input_type = (element.get('type') or 'text').lower()
+        if not name or input_type in ('submit', 'button', 'image', 'reset'):
+            continue
+        if input_type in ('checkbox', 'radio') and not element.has_attr('checked'):
+            continue
+        fields[name] = element.get('value', '')
+    fields[url_input.get('name') or 'url'] = domain_name
+
+    submit = form.find('input', attrs={'type': 'submit', 'value': 'Find Email'})
+    if submit is not None and submit.get('name'):
+        fields[submit['name']] = submit['value']
+
+    action = urllib.parse.urljoin(page_url, form.get('action') or '')
+    return (form.get('method') or 'get').lower(), action, fields
+
+
+def scrape_data_http(domain_name, url, session=None):
+    """
+    Looks up a domain without a browser: loads the form, submits it and reads the results table.
+    :return: A list of [domain_name] + row lists, which is empty when the table lists nothing.
+    :raises NeedsBrowser: When the form or the table is missing from the responses.
+    """
+    session = session or get_session()
+    # One User-Agent for both requests, as a browser would send
+    headers = {'User-Agent': random_user_agent()}
+
+    response = session.get(url, headers=headers)
+    if response.status_code != 200:
+        raise NeedsBrowser(f"form page returned {response.status_code}")
+    form_request = build_form_request(response.text, response.url, domain_name)
+    if form_request is None:
+        raise NeedsBrowser("no lookup form in the page")
+
+    method, action, fields = form_request
+    headers['Referer'] = response.url
+    if method == 'post':
+        response = session.post(action, data=fields, headers=headers)
+    else:
+        response = session.get(action, params=fields, headers=headers)
+    if response.status_code != 200:
+        raise NeedsBrowser(f"lookup returned {response.status_code}")
+    if '<table' not in response.text.lower():
+        raise NeedsBrowser("no results table, the page probably needs JavaScript")
+
+    return [[domain_name] + row_data for row_data in parse_table_rows(response.text)]
+
+
+def find_contact_rows(domain_name, url, mode=None):
+    """
+    Looks up one domain with the configured lookup mode, falling back to Chrome in auto mode.
+    :param mode: "auto", "http" or "selenium"; defaults to CONTACT_LOOKUP_MODE.
+    :return: A list of [domain_name] + row lists.
+    """
+    mode = mode or CONTACT_LOOKUP_MODE
+    if mode in ('auto', 'http'):
+        started = time.perf_counter()
+        try:
+            rows = scrape_data_http(domain_name, url)
+            lookup_stats.record('http', 'successes', time.perf_counter() - started)
+            return rows
+        except (NeedsBrowser, requests.RequestException) as e:
+            if mode == 'http':
+                lookup_stats.record('http', 'failures', time.perf_counter() - started)
+                raise
+            lookup_stats.record('http', 'fallbacks', time.perf_counter() - started)
+            print(f"HTTP lookup for {domain_name} failed ({e}), falling back to Chrome")
+
+    started = time.perf_counter()
+    try:
+        rows = list(scrape_data(None, domain_name, url))
+    except Exception:
+        lookup_stats.record('selenium', 'failures', time.perf_counter() - started)
+        raise
+    lookup_stats.record('selenium', 'successes', time.perf_counter() - started)
+    return rows
+
 
 def scrape_data(driver, domain_name, url, max_retries=2):
+    # Without a driver of its own, borrow a warm one from the shared pool for the whole lookup
+    if driver is None:
+        with get_pool().driver() as pooled_driver:
+            yield from scrape_data(pooled_driver, domain_name, url, max_retries)
+        return
+
     retries = 0
     while retries < max_retries:
         try:
@@ -32,18 +198,11 @@ def scrape_data(driver, domain_name, url, max_retries=2):
 
             print("Processing table data...")
             table_html = driver.find_element(By.TAG_NAME, "table").get_attribute('outerHTML')
-            soup = BeautifulSoup(table_html, 'html.parser')
-            table_rows = soup.find_all('tr')
 
             data_found = False
-            for i, row in enumerate(table_rows):
-                if i == 0:  # Skip the header row
-                    continue
-                cols = row.find_all(['th', 'td'])
-                row_data = [ele.text.strip() for ele in cols]
-                if row_data and not all(col == 'Not Found' for col in row_data):
-                    data_found = True
-                    yield [domain_name] + row_data
+            for row_data in parse_table_rows(table_html):
+                data_found = True
+                yield [domain_name] + row_data
 
             if not data_found:
                 retries += 1
@@ -0,0 +1,47 @@
+import os
+from bs4 import BeautifulSoup, SoupStrainer
+
+# "html.parser" is always available; "lxml" is much faster when the lxml package is installed
+HTML_PARSER = os.getenv('HTML_PARSER', 'html.parser')
+# Set to 0 to build the whole document tree, as the scrapers originally did
+STRAINED_PARSING = os.getenv('STRAINED_PARSING', '1') == '1'
+
+
+def has_class(attrs, name):
+    # While parsing, class is still the raw attribute string; on a built Tag it is a list
+    value = attrs.get('class') or ()
+    if isinstance(value, str):
+        value = value.split()
+    return name in value
+
+
+def tag_filter(predicate):
+    """
+    Builds a parse_only filter from predicate(name, attrs) so that only matching subtrees are built.
+    """
+    if hasattr(SoupStrainer, 'allow_tag_creation'):  # beautifulsoup4 >= 4.13
+        class _Filter(SoupStrainer):
+            def allow_tag_creation(self, nsprefix, name, attrs):
+                return predicate(name, attrs or {})
+        return _Filter()
+    return SoupStrainer(lambda name, attrs=None: predicate(name, attrs or {}))
+
+
+# Everything the Yellow Pages scraper reads from a search page lives under `.result`
+SEARCH_RESULTS = tag_filter(lambda name, attrs: has_class(attrs, 'result'))
+# Detail pages are read from #listing-card, plus the website link which sits outside of it
+LISTING_DETAIL = tag_filter(lambda name, attrs: (name == 'div' and attrs.get('id') == 'listing-card')
+                            or (name == 'a' and has_class(attrs, 'website-link')))
+TABLES = tag_filter(lambda name, attrs: name == 'table')
+FORMS = tag_filter(lambda name, attrs: name == 'form')
+
+
+def make_soup(html, parse_only=None, parser=None, strained=None):
+    """
+    Parses `html` with the configured parser, building only the subtrees `parse_only` selects.
+    Queries against the result give the same answers as against the full document
+    as long as they only look inside those subtrees.
+    """
+    if strained is None:
+        strained = STRAINED_PARSING
+    return BeautifulSoup(html, parser or HTML_PARSER, parse_only=parse_only if strained else None)
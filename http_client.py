@@ -0,0 +1,99 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utils import random_user_agent
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.5))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+# Longest a Retry-After header may make a thread wait before the next attempt
+HTTP_MAX_RETRY_AFTER = float(os.getenv('HTTP_MAX_RETRY_AFTER', 60))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+
+
+class CappedRetry(Retry):
+    """
+    urllib3 Retry that waits at most HTTP_MAX_RETRY_AFTER seconds for a Retry-After header.
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return min(retry_after, HTTP_MAX_RETRY_AFTER) if retry_after is not None else None
+
+
+def default_retry(statuses=True):
+    """
+    Retries connection errors and 429/5xx responses with exponential backoff, honouring a capped Retry-After.
+    The last response is returned rather than raised once the retries run out.
+    :param statuses: False to only retry connection errors, for hosts whose rate limiter retries statuses itself
+                     (see rate_limiter.HostRateLimiter.get) so every attempt takes a token.
+    """
+    status_retries = HTTP_RETRIES if statuses else 0
+    return CappedRetry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=HTTP_RETRIES, status=status_retries,
+                       backoff_factor=HTTP_BACKOFF, status_forcelist=RETRY_STATUSES if statuses else (),
+                       allowed_methods=frozenset(['GET', 'HEAD', 'POST']),
+                       respect_retry_after_header=True, raise_on_status=False)
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session with a default timeout and a User-Agent picked from utils.USER_AGENTS for every request
+    that does not set its own.
+    """
+
+    def __init__(self, retry=None, pool_maxsize=HTTP_POOL_SIZE):
+        super().__init__()
+        self.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize,
+                              max_retries=retry if retry is not None else default_retry())
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        headers = kwargs.pop('headers', None) or {}
+        if not any(name.lower() == 'user-agent' for name in headers):
+            headers = dict(headers, **{'User-Agent': random_user_agent()})
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        return super().request(method, url, headers=headers, **kwargs)
+
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def get_session(status_retries=True):
+    """
+    The process-wide session every scraper shares, so connections stay open across tasks.
+    :param status_retries: False for the session of rate-limited hosts, which only retries connection errors.
+    """
+    with _session_lock:
+        if status_retries not in _sessions:
+            _sessions[status_retries] = PooledSession(retry=default_retry(statuses=status_retries))
+        return _sessions[status_retries]
+
+
+def retry_delay(response, attempt):
+    """
+    How long to wait before retrying `response`: its Retry-After in seconds, capped at HTTP_MAX_RETRY_AFTER,
+    or exponential backoff like the adapter's.
+    """
+    retry_after = response.headers.get('Retry-After', '')
+    try:
+        return min(max(0.0, float(retry_after)), HTTP_MAX_RETRY_AFTER)
+    except ValueError:
+        return min(HTTP_BACKOFF * 2 ** attempt, HTTP_MAX_RETRY_AFTER)
+
+
+def retried_statuses(response):
+    # Statuses urllib3 retried before handing back `response`
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return [entry.status for entry in (retries.history if retries else ()) if entry.status]
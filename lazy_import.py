@@ -0,0 +1,33 @@
+import importlib
+import sys
+
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported the first time one of its attributes is used,
+    so a web worker that only serves /task_status never loads selenium, bs4 or openai.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            # import_module holds the per-module import lock, so concurrent first uses import it once
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name!r}{' (loaded)' if loaded(self) else ''}>"
+
+
+def loaded(module):
+    """
+    :param module: A LazyModule.
+    :return: The real module if something has imported it already, otherwise None; never imports it.
+    """
+    return sys.modules.get(module._name)
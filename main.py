@@ -1,12 +1,16 @@
-from selenium.webdriver.chrome.service import Service
+import csv
+import io
 import json
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from fake_useragent import UserAgent
-from yellowpages_scraper import scrape_yellow_pages_first_page
-from email_finder import scrape_data
+from yellowpages_scraper import scrape_yellow_pages_first_page, scrape_yellow_pages_pages
+from email_finder import find_contact_rows
+from utils import normalize_domain
+import metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 
+EMAIL_FINDER_URL = os.getenv('EMAIL_FINDER_URL', "https://emailbydomain.com/")
+
 def format_yellow_pages_data(data):
     return [{
         "Lead_id": item[0],
@@ -27,12 +31,24 @@ def format_email_data(data):
         "Title": item[3] if item[3] != "None" else None,
         "Source": item[4]
     } for item in data]
-def scrape_yellow_pages(searchterm, location, leadid):
-    # Set up Selenium WebDriver for Yellow Pages
+def scrape_yellow_pages(searchterm, location, leadid, max_pages=1, max_results=None, use_cache=True, on_rows=None,
+                        lookup_known=None):
+    # on_rows, when given, receives each page's formatted rows as soon as the page is done;
+    # lookup_known lets businesses already in the lead index skip their detail page
+    on_page = (lambda rows: on_rows(format_yellow_pages_data(rows))) if on_rows else None
 
     try:
-        yellow_pages_data = scrape_yellow_pages_first_page(searchterm, location, leadid)
+        if max_pages > 1 or max_results:
+            yellow_pages_data = scrape_yellow_pages_pages(searchterm, location, leadid, max_pages=max_pages,
+                                                          max_results=max_results,
+                                                          page_workers=int(os.getenv('YELLOWPAGES_PAGE_WORKERS', 3)),
+                                                          use_cache=use_cache, on_page=on_page,
+                                                          lookup_known=lookup_known)
+        else:
+            yellow_pages_data = scrape_yellow_pages_first_page(searchterm, location, leadid, use_cache=use_cache,
+                                                               on_page=on_page, lookup_known=lookup_known)
         formatted_data = format_yellow_pages_data(yellow_pages_data)
+        metrics.inc('yp_listings', len(formatted_data))
         return formatted_data
     except Exception as e:
         print(f"An error occurred while scraping Yellow Pages: {e}")
@@ -40,32 +56,135 @@ def scrape_yellow_pages(searchterm, location, leadid):
 
 
 def find_contacts(website_url):
-    # Set up Selenium WebDriver for Email Finder
-    chrome_options = Options()
-    chrome_options.binary_location = os.getenv('GOOGLE_CHROME_BIN')
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-
-    # Initialize the Service with the path to ChromeDriver
-    service = Service(executable_path=os.getenv('CHROMEDRIVER_PATH'))
-
-    # Create the WebDriver instance specifying both the service and options
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-
+    # Plain HTTP first; Chrome sessions, when needed, come from the shared warm pool
     try:
-        email_data = scrape_data(driver, website_url, "https://emailbydomain.com/")
+        email_data = find_contact_rows(website_url, EMAIL_FINDER_URL)
         formatted_contacts = format_email_data(email_data)
         return formatted_contacts
     except Exception as e:
         print(f"An error occurred while finding contacts: {e}")
-    finally:
-        if driver:
-            driver.quit()
 
 
+def dedupe_domains(websites):
+    # Keeps the first spelling's position so results come back in submission order where possible
+    domains = []
+    seen = set()
+    for website in websites:
+        domain = normalize_domain(website)
+        if domain and domain not in seen:
+            seen.add(domain)
+            domains.append(domain)
+    return domains
+
+
+def find_contacts_batch(domains, max_workers=2, lookup=None):
+    """
+    Looks up contacts for many domains in parallel and yields (domain, contacts, error) as each one finishes.
+    A failure on one domain is reported for that domain only.
+    :param lookup: Function returning the contacts for one domain, or None if the lookup failed.
+    """
+    if lookup is None:
+        lookup = lambda domain: format_email_data(find_contact_rows(domain, EMAIL_FINDER_URL))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(metrics.propagate(lookup), domain): domain for domain in domains}
+        for future in as_completed(futures):
+            domain = futures[future]
+            try:
+                contacts = future.result()
+                if contacts is None:
+                    raise RuntimeError("Contact lookup failed")
+                yield domain, contacts, None
+            except Exception as e:
+                print(f"An error occurred while finding contacts for {domain}: {e}")
+                yield domain, None, str(e)
+
+
+
+
+
+def read_search_rows(text, fmt):
+    """
+    Reads (searchterm, location, leadid) rows from an uploaded CSV (with a header row) or JSON Lines file.
+    :param fmt: "csv" or "jsonl".
+    :return: (rows, invalid) where rows are dicts and invalid counts the lines that were skipped.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        records = ({(key or '').strip().lower(): value for key, value in record.items()} for record in reader)
+    else:
+        records = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+
+    rows = []
+    invalid = 0
+    for record in records:
+        if not isinstance(record, dict):
+            invalid += 1
+            continue
+        searchterm = str(record.get('searchterm') or '').strip()
+        location = str(record.get('location') or '').strip()
+        leadid = record.get('leadid')
+        leadid = leadid.strip() if isinstance(leadid, str) else leadid
+        if not (searchterm and location and leadid) or isinstance(leadid, (dict, list)):
+            invalid += 1
+            continue
+        rows.append({"searchterm": searchterm, "location": location, "leadid": leadid})
+    return rows, invalid
+
+
+def group_searches(rows):
+    """
+    Collapses rows that ask for the same search into one search carrying every leadid that wants it.
+    Searches are ordered by location so that searches in the same city run close together.
+    :return: A list of {"searchterm", "location", "leadids"} dicts.
+    """
+    searches = {}
+    seen_leadids = {}  # key -> set of the search's leadids, so a big upload groups in linear time
+    for row in rows:
+        key = (' '.join(row["location"].lower().split()), ' '.join(row["searchterm"].lower().split()))
+        search = searches.setdefault(key, {"searchterm": row["searchterm"], "location": row["location"],
+                                           "leadids": []})
+        seen = seen_leadids.setdefault(key, set())
+        if row["leadid"] not in seen:
+            seen.add(row["leadid"])
+            search["leadids"].append(row["leadid"])
+    return [searches[key] for key in sorted(searches, key=lambda key: key[0])]
+
+
+def fan_out_rows(rows, leadids):
+    # One copy of a search's rows per lead that asked for it
+    return [dict(row, Lead_id=leadid) for leadid in leadids for row in rows]
+
+
+def scrape_yellow_pages_bulk(searches, max_workers=3, scrape=None):
+    """
+    Runs many searches on a bounded set of workers and yields (index, rows, error) as each one finishes.
+    Searches are started in the order given. A failure on one search is reported for that search only.
+    :param scrape: Function returning the rows of one search dict, or None if it failed.
+    """
+    if scrape is None:
+        scrape = lambda search: scrape_yellow_pages(search["searchterm"], search["location"], search["leadids"][0])
 
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(metrics.propagate(scrape), search): index for index, search in enumerate(searches)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                rows = future.result()
+                if rows is None:
+                    raise RuntimeError("Scraping Yellow Pages returned no results")
+                yield index, rows, None
+            except Exception as e:
+                print(f"An error occurred while scraping {searches[index]['searchterm']} in "
+                      f"{searches[index]['location']}: {e}")
+                yield index, None, str(e)
 
 
 # The following code is for testing purposes
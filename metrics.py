@@ -0,0 +1,160 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Set to 0 to turn every timer and counter into a no-op
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_NOOP = nullcontext()
+
+
+class Registry:
+    """
+    Process-wide stage timings (as histograms) and event counters, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, stage, seconds, labels=()):
+        key = (stage,) + labels
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+
+    def inc(self, event, value=1, labels=()):
+        key = (event,) + labels
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self, gauges=None):
+        """
+        :param gauges: Optional {name: {labels tuple: value}} of point-in-time values to include.
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = {key: dict(value, buckets=list(value["buckets"])) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = ["# HELP scraper_stage_seconds Time spent per pipeline stage.",
+                 "# TYPE scraper_stage_seconds histogram"]
+        for (stage, *labels), histogram in sorted(histograms.items()):
+            label_text = format_labels((("stage", stage),) + tuple(labels))
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append(f'scraper_stage_seconds_bucket{label_text[:-1]},le="{bound}"}} {count}')
+            lines.append(f'scraper_stage_seconds_bucket{label_text[:-1]},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'scraper_stage_seconds_sum{label_text} {histogram["sum"]:.6f}')
+            lines.append(f'scraper_stage_seconds_count{label_text} {histogram["count"]}')
+
+        lines += ["# HELP scraper_events_total Counted pipeline events.",
+                  "# TYPE scraper_events_total counter"]
+        for (event, *labels), value in sorted(counters.items()):
+            lines.append(f'scraper_events_total{format_labels((("event", event),) + tuple(labels))} {value}')
+
+        for name, values in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class TaskTimings:
+    """
+    Per-task totals of the same stages, collected while a task runs so they can be stored with it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: {"count": totals["count"], "seconds": round(totals["seconds"], 4)}
+                    for stage, totals in sorted(self.stages.items())}
+
+
+registry = Registry()
+_current_task = contextvars.ContextVar('task_timings', default=None)
+
+
+def observe(stage, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    registry.observe(stage, seconds, tuple(sorted(labels.items())))
+    task = _current_task.get()
+    if task is not None:
+        task.add(stage, seconds)
+
+
+def inc(event, value=1, **labels):
+    if METRICS_ENABLED:
+        registry.inc(event, value, tuple(sorted(labels.items())))
+
+
+@contextmanager
+def _timer(stage, labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, **labels)
+
+
+def timer(stage, **labels):
+    """
+    Context manager timing the block as `stage`; a shared no-op when metrics are disabled.
+    """
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _timer(stage, labels)
+
+
+@contextmanager
+def task_timings():
+    """
+    Collects the stage timings of the current task, including those of threads started through `propagate`.
+    """
+    timings = TaskTimings()
+    token = _current_task.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_task.reset(token)
+
+
+def propagate(fn):
+    """
+    Wraps `fn` so that, run in a pool thread, its timings still count towards the task that submitted it.
+    """
+    if not METRICS_ENABLED or _current_task.get() is None:
+        return fn
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def render(gauges=None):
+    return registry.render(gauges)
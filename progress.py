@@ -0,0 +1,68 @@
+import threading
+import time
+
+TERMINAL_STATUSES = ('success', 'error')
+
+
+class ProgressBroker:
+    """
+    In-process log of progress events per task that request handlers can block on.
+    Every event gets a per-task sequence number so a client can resume after the last one it saw.
+    :param max_events: Events kept per task; older ones are dropped first.
+    :param retention: Seconds a finished task's events are kept for late subscribers.
+    :param idle_retention: Seconds an unfinished task is kept without a new event, so the events of tasks
+                           that never finish here (e.g. lost in a crash) do not pile up.
+    """
+
+    def __init__(self, max_events=5000, retention=600, idle_retention=6 * 3600):
+        self.max_events = max_events
+        self.retention = retention
+        self.idle_retention = idle_retention
+        self._tasks = {}
+        self._cond = threading.Condition()
+
+    def publish(self, task_id, event, data=None):
+        with self._cond:
+            task = self._tasks.setdefault(task_id, {"events": [], "seq": 0, "finished_at": None})
+            task["updated_at"] = time.monotonic()
+            task["seq"] += 1
+            task["events"].append({"id": task["seq"], "event": event, "data": data})
+            if len(task["events"]) > self.max_events:
+                del task["events"][0]
+            if event == 'status' and data and data.get("status") in TERMINAL_STATUSES:
+                task["finished_at"] = time.monotonic()
+            self._prune()
+            self._cond.notify_all()
+
+    def discard(self, task_id):
+        # Forgets a task that was never started, e.g. because its queue was full
+        with self._cond:
+            self._tasks.pop(task_id, None)
+
+    def knows(self, task_id):
+        with self._cond:
+            return task_id in self._tasks
+
+    def wait(self, task_id, after=0, timeout=25):
+        """
+        Returns the task's events newer than `after`, waiting up to `timeout` seconds for one to arrive.
+        :return: (events, finished); events is empty on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                task = self._tasks.get(task_id)
+                events = [e for e in task["events"] if e["id"] > after] if task else []
+                finished = bool(task and task["finished_at"] is not None)
+                remaining = deadline - time.monotonic()
+                if events or finished or remaining <= 0:
+                    return events, finished
+                self._cond.wait(remaining)
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [task_id for task_id, task in self._tasks.items()
+                   if (task["finished_at"] is not None and now - task["finished_at"] > self.retention)
+                   or now - task["updated_at"] > self.idle_retention]
+        for task_id in expired:
+            del self._tasks[task_id]
@@ -0,0 +1,105 @@
+import threading
+import time
+import urllib.parse
+import metrics
+from http_client import HTTP_RETRIES, RETRY_STATUSES, retried_statuses, retry_delay
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to `burst` requests.
+    The rate drops when the server pushes back and creeps back up on successful responses.
+    """
+
+    def __init__(self, rate, burst, min_rate=None):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+        metrics.observe('rate_limit_wait', waited)
+
+    def slow_down(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.base_rate, self.rate * 1.1)
+
+
+class HostRateLimiter:
+    """
+    Keeps one TokenBucket per host so politeness limits apply per site, across all threads.
+    :param rate: Requests per second allowed for each host.
+    :param burst: Number of requests a host may receive back to back.
+    """
+
+    SLOW_DOWN_STATUSES = (429, 503)
+
+    def __init__(self, rate=1.0, burst=3):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urllib.parse.urlsplit(url).hostname or ''
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    def record(self, url, response):
+        """
+        Adjusts the host's rate after a response: back off on 429/503, recover otherwise.
+        A 429/503 the HTTP client already retried counts too, even if the retry succeeded.
+        """
+        bucket = self.bucket(url)
+        pushed_back = [status for status in retried_statuses(response) if status in self.SLOW_DOWN_STATUSES]
+        if response.status_code in self.SLOW_DOWN_STATUSES or pushed_back:
+            retry_after = response.headers.get('Retry-After')
+            bucket.slow_down(retry_delay(response, 0) if retry_after and retry_after.isdigit() else None)
+            print(f"Slowing down requests to {urllib.parse.urlsplit(url).hostname} to {bucket.rate:.2f}/s")
+        else:
+            bucket.speed_up()
+
+    def get(self, session, url, **kwargs):
+        """
+        Sends a rate-limited GET through `session` and feeds the response back into the limiter.
+        429/5xx responses are retried here rather than in the HTTP adapter, so every attempt waits for a token;
+        `session` should come from http_client.get_session(status_retries=False).
+        """
+        for attempt in range(HTTP_RETRIES + 1):
+            self.acquire(url)
+            response = session.get(url, **kwargs)
+            self.record(url, response)
+            if response.status_code not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return response
+            time.sleep(retry_delay(response, attempt))
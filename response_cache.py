@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+
+def normalize_url(url):
+    """
+    Builds the cache key for a URL: lowercase scheme and host, no default port or fragment, sorted query.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+class ResponseCache:
+    """
+    On-disk cache of fetched HTML, stored zlib-compressed in SQLite so every worker process shares it.
+    :param path: SQLite database file.
+    :param ttls: Seconds each page type stays fresh, e.g. {"search": 21600, "detail": 604800}.
+    :param max_bytes: Compressed size above which the least recently used pages are evicted.
+    """
+
+    EVICT_EVERY = 20
+
+    def __init__(self, path, ttls, max_bytes):
+        self.path = path
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._counters = {}
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "key TEXT PRIMARY KEY, page_type TEXT NOT NULL, body BLOB NOT NULL, "
+                         "size INTEGER NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, page_type, outcome):
+        with self._lock:
+            key = (page_type, outcome)
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def get(self, url, page_type):
+        """
+        :return: The cached HTML, or None on a miss or an expired entry.
+        """
+        key = normalize_url(url)
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT body, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > self.ttls.get(page_type, 0):
+            if row is not None:
+                with conn:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._count(page_type, 'misses')
+            return None
+        with conn:
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count(page_type, 'hits')
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def put(self, url, page_type, text):
+        body = zlib.compress(text.encode('utf-8'), 6)
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO responses (key, page_type, body, size, stored_at, accessed_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (normalize_url(url), page_type, body, len(body), now, now))
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % self.EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops the least recently used pages until the cache is back under 90% of max_bytes.
+        """
+        conn = self._connection()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        with conn:
+            conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._count('all', 'evictions')
+
+    def stats(self):
+        conn = self._connection()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        with self._lock:
+            counters = dict(self._counters)
+        stats = {"entries": entries, "bytes": size, "max_bytes": self.max_bytes,
+                 "evictions": counters.pop(('all', 'evictions'), 0)}
+        for (page_type, outcome), count in counters.items():
+            stats.setdefault(page_type, {"hits": 0, "misses": 0})[outcome] = count
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the process-wide response cache, or None when RESPONSE_CACHE_ENABLED is 0.
+    """
+    global _cache
+    if os.getenv('RESPONSE_CACHE_ENABLED', '1') != '1':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(os.getenv('RESPONSE_CACHE_PATH', 'response_cache.sqlite3'),
+                                   ttls={"search": int(os.getenv('RESPONSE_CACHE_SEARCH_TTL', 6 * 3600)),
+                                         "detail": int(os.getenv('RESPONSE_CACHE_DETAIL_TTL', 7 * 24 * 3600))},
+                                   max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_MB', 200)) * 1024 * 1024)
+        return _cache
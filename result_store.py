@@ -0,0 +1,51 @@
+import json
+import zlib
+
+# Bumped when the packed layout changes; unpack_rows still reads every earlier version
+FORMAT_VERSION = 2
+
+
+def pack_rows(rows, level=6):
+    """
+    Packs a list of row dicts into a compressed columnar blob.
+    Rows are grouped by their set of keys (a "shape"), and each shape stores its values column by column,
+    so repeated values sit next to each other and compress well. The shape of every row is kept in order,
+    so rows of different shapes come back in their original order with their exact keys.
+    :return: The zlib-compressed JSON payload as bytes.
+    """
+    shapes = []
+    shape_ids = {}
+    columns = []
+    order = []
+    for row in rows:
+        keys = tuple(row)
+        shape = shape_ids.get(keys)
+        if shape is None:
+            shape = shape_ids[keys] = len(shapes)
+            shapes.append(list(keys))
+            columns.append([[] for _ in keys])
+        order.append(shape)
+        for column, key in zip(columns[shape], keys):
+            column.append(row[key])
+    payload = {"v": FORMAT_VERSION, "shapes": shapes, "order": order, "columns": columns}
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), level)
+
+
+def unpack_rows(blob):
+    """
+    Reverses pack_rows.
+    :return: The list of row dicts.
+    """
+    payload = json.loads(zlib.decompress(blob))
+    shapes = payload["shapes"]
+    if payload["v"] == 1:
+        # Version 1 stored each row as [shape, value, value, ...]
+        return [dict(zip(shapes[row[0]], row[1:])) for row in payload["rows"]]
+
+    positions = [0] * len(shapes)
+    rows = []
+    for shape in payload["order"]:
+        position = positions[shape]
+        rows.append({key: column[position] for key, column in zip(shapes[shape], payload["columns"][shape])})
+        positions[shape] = position + 1
+    return rows
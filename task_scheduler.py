@@ -0,0 +1,111 @@
+import math
+import queue
+import threading
+import time
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a pool's queue has no room for another task.
+    :param pool_name: Name of the pool that rejected the task.
+    :param retry_after: Suggested number of seconds to wait before retrying.
+    """
+
+    def __init__(self, pool_name, retry_after):
+        super().__init__(f"The '{pool_name}' task queue is full.")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+class TaskPool:
+    """
+    A fixed number of worker threads fed from a bounded queue.
+    Workers are started on the first submit so the pool is safe to create
+    before gunicorn forks its workers.
+    """
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(1, max_queue)
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._total_duration = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            raise QueueFullError(self.name, self.retry_after())
+
+    def retry_after(self, default=30):
+        """
+        Estimates how long until a queue slot frees up, based on the average task duration.
+        """
+        with self._lock:
+            if not self._completed:
+                return default
+            average = self._total_duration / self._completed
+        waves = math.ceil((self._queue.qsize() + 1) / self.max_workers)
+        return min(600, max(1, math.ceil(average * waves)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "completed": self._completed,
+            }
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f"{self.name}-worker-{len(self._threads) + 1}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._running += 1
+            started = time.monotonic()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"Unhandled error in {self.name} task: {e}")
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._total_duration += time.monotonic() - started
+                self._queue.task_done()
+
+
+class TaskScheduler:
+    """
+    Holds one TaskPool per kind of work so each kind has its own concurrency limit.
+    """
+
+    def __init__(self):
+        self._pools = {}
+
+    def add_pool(self, name, max_workers, max_queue):
+        self._pools[name] = TaskPool(name, max_workers, max_queue)
+        return self._pools[name]
+
+    def submit(self, pool_name, fn, *args, **kwargs):
+        self._pools[pool_name].submit(fn, *args, **kwargs)
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self._pools.items()}
@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# app.py and the scraper modules read their settings at import time
+_workdir = tempfile.mkdtemp(prefix='akshay-api-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'tasks.db')}"
+os.environ['RESPONSE_CACHE_PATH'] = os.path.join(_workdir, 'response_cache.sqlite3')
+os.environ.setdefault('OPENAI_API_KEY', 'stand-in')
+
+
+@pytest.fixture
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def db_backend(app_module, monkeypatch):
+    # TASK_BACKEND is read when a task is submitted or its events are requested, so patching the module is enough
+    monkeypatch.setattr(app_module, 'TASK_BACKEND', 'db')
+    monkeypatch.setattr(app_module, 'TASK_EVENTS_DB_POLL', 0.05)
+    return app_module
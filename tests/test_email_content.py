@@ -0,0 +1,76 @@
+import openai
+import pytest
+
+import email_content
+from standin_server import StandInServer
+
+
+@pytest.fixture
+def completion_server(monkeypatch):
+    server = StandInServer().start()
+    monkeypatch.setattr(openai, 'api_base', f"{server.url}/v1")
+    monkeypatch.setattr(email_content, 'email_cache', email_content.EmailCache())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Records the backoff delays instead of waiting them out
+    delays = []
+    monkeypatch.setattr(email_content.time, 'sleep', delays.append)
+    return delays
+
+
+def test_create_completion_retries_rate_limits_after_retry_after(completion_server, sleeps):
+    completion_server.fail_next(2, status=429, retry_after='0')
+    response = email_content.create_completion(email_content.build_messages("Acme", "acme.com"))
+
+    assert "Acme" in response.choices[0].message['content']
+    assert completion_server.requests == 3
+    assert sleeps == [0.0, 0.0]
+
+
+def test_create_completion_backs_off_exponentially_without_retry_after(completion_server, sleeps):
+    completion_server.fail_next(3, status=503, retry_after=None)
+    email_content.create_completion(email_content.build_messages("Acme", "acme.com"))
+
+    assert completion_server.requests == 4
+    # min(30, 2 ** attempt) with jitter between half and all of it
+    for attempt, delay in enumerate(sleeps):
+        assert 2 ** attempt * 0.5 <= delay <= 2 ** attempt
+
+
+def test_create_completion_gives_up_after_max_retries(completion_server, sleeps, monkeypatch):
+    monkeypatch.setattr(email_content, 'EMAIL_MAX_RETRIES', 2)
+    completion_server.fail_next(5, status=429, retry_after='0')
+
+    with pytest.raises(openai.error.RateLimitError):
+        email_content.create_completion(email_content.build_messages("Acme", "acme.com"))
+    assert completion_server.requests == 3
+
+
+def test_generate_outreach_email_is_served_from_the_cache(completion_server):
+    first = email_content.generate_outreach_email("Acme", "acme.com")
+    second = email_content.generate_outreach_email("Acme", "acme.com")
+
+    assert first == second
+    assert completion_server.requests == 1
+    assert email_content.email_cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+
+def test_generate_outreach_emails_reports_failures_per_lead(completion_server, sleeps):
+    completion_server.reject_lead("Broken Co")
+    leads = [("Acme", "acme.com"), ("Broken Co", "broken.example"), ("Globex", "globex.com")]
+
+    results = {index: (email, error) for index, email, error in
+               email_content.generate_outreach_emails(leads, max_workers=3)}
+
+    assert sorted(results) == [0, 1, 2]
+    assert results[1][0] is None and "Rejected lead Broken Co" in results[1][1]
+    for index in (0, 2):
+        email, error = results[index]
+        assert error is None and leads[index][0] in email
+    # An invalid request is not retried
+    assert completion_server.requests == 3 and sleeps == []
@@ -0,0 +1,61 @@
+import pytest
+
+
+def listing(title, phone_number=None, website_url=None, full_address=None, city='Springfield'):
+    return {"title": title, "phone_number": phone_number, "website_url": website_url, "full_address": full_address,
+            "city": city, "state": None, "zip_code": None, "detail_url": "/mip/1"}
+
+
+def row(title, phone, website, address, city='Springfield'):
+    return {"Company_name": title, "Phone_no": phone, "Website": website, "Address": address, "City": city,
+            "State": "IL", "Zipcode": "62701"}
+
+
+@pytest.fixture
+def lead_index(app_module):
+    with app_module.app.app_context():
+        app_module.Company.query.delete()
+        app_module.db.session.commit()
+        yield app_module
+
+
+def test_another_branch_supplies_only_the_business_fields(lead_index):
+    import yellowpages_scraper
+    lead_index.remember_companies([row("Subway", "(217) 555-0001", "https://www.subway.com", "1 Main St")])
+
+    branch = listing("Subway", website_url="subway.com", full_address="9 Elm St")
+    known = lead_index.find_known_companies([branch])[0]
+    assert known == {"title": "Subway", "website_url": "https://www.subway.com"}
+    # Without a phone number of its own the listing still needs its detail page
+    assert yellowpages_scraper.apply_known(branch, known)["detail_url"] == "/mip/1"
+    assert branch["phone_number"] is None
+
+    same_branch = listing("Subway", website_url="subway.com", full_address="1 Main St.")
+    assert lead_index.find_known_companies([same_branch])[0]["phone_number"] == "(217) 555-0001"
+
+
+def test_branches_of_a_chain_keep_their_own_entries(lead_index):
+    lead_index.remember_companies([row("Subway", "(217) 555-0001", "subway.com", "1 Main St"),
+                                   row("Subway", "(217) 555-0002", "subway.com", "9 Elm St"),
+                                   row("Subway", "217.555.0002", "subway.com", "9 Elm Street")])
+    lead_index.remember_companies([row("Subway", None, "subway.com", "1 Main St")])
+
+    companies = {c.phone_key: c.full_address for c in lead_index.Company.query}
+    assert companies == {"2175550001": "1 Main St", "2175550002": "9 Elm Street"}
+
+
+def test_ensure_schema_makes_phone_keys_unique(lead_index):
+    Company, db = lead_index.Company, lead_index.db
+    with db.engine.begin() as conn:
+        conn.execute(db.text('DROP INDEX ux_company_t_phone_key'))
+    for address in ("1 Main St", "9 Elm St"):
+        db.session.add(Company(phone_key="2175550001", full_address=address, updated_at=lead_index.datetime.utcnow()))
+    db.session.commit()
+
+    lead_index.ensure_schema()
+    assert [(c.phone_key, c.full_address) for c in Company.query.order_by(Company.id)] == \
+        [(None, "1 Main St"), ("2175550001", "9 Elm St")]
+    db.session.add(Company(phone_key="2175550001", updated_at=lead_index.datetime.utcnow()))
+    with pytest.raises(lead_index.IntegrityError):
+        db.session.commit()
+    db.session.rollback()
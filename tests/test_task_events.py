@@ -0,0 +1,41 @@
+import json
+
+
+def set_status(app_module, task_id, status):
+    with app_module.app.app_context():
+        app_module.Task.query.filter_by(task_id=task_id).update({"status": status})
+        app_module.db.session.commit()
+
+
+def test_db_backend_long_poll_sees_status_written_by_a_worker(db_backend, client):
+    task_id = client.post('/contacts', json={"website": "example.com"}).get_json()["task_id"]
+    # The task runs in worker.py, so nothing about it may be recorded in this process's broker
+    assert not db_backend.progress_broker.knows(task_id)
+
+    set_status(db_backend, task_id, 'success')
+    body = client.get(f'/task_events/{task_id}?since=1&wait=1').get_json()
+    assert body["finished"] is True
+    assert body["events"][0]["data"] == {"status": 'success'}
+
+
+def test_db_backend_event_stream_ends_with_terminal_status(db_backend, client):
+    task_id = client.post('/contacts', json={"website": "example.org"}).get_json()["task_id"]
+    set_status(db_backend, task_id, 'error')
+
+    response = client.get(f'/task_events/{task_id}', headers={"Accept": "text/event-stream"})
+    events = [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).splitlines()
+              if line.startswith('data: ')]
+    assert events == [{"status": 'error'}]
+
+
+def test_rejected_task_leaves_nothing_in_the_broker(app_module, client, monkeypatch):
+    submitted = []
+
+    def full(pool_name, *args):
+        submitted.append(args[1])
+        raise app_module.QueueFullError(pool_name, 5)
+    monkeypatch.setattr(app_module.scheduler, 'submit', full)
+
+    response = client.post('/contacts', json={"website": "example.net"})
+    assert response.status_code == 429
+    assert not app_module.progress_broker.knows(submitted[0])
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def email_batch_task(app_module):
+    task_id = 'status-email-batch'
+    with app_module.app.app_context():
+        if not app_module.Task.query.filter_by(task_id=task_id).first():
+            app_module.db.session.add(app_module.Task(task_id=task_id, status='success',
+                                                      params=json.dumps({"kind": "email_batch", "args": {}})))
+            writer = app_module.ResultWriter(task_id)
+            # Saved in the order they finished, not in lead order
+            for index in (2, 0, 3, 1):
+                writer.add([{"index": index, "status": "success", "email_content": f"email {index}"}],
+                           checkpoint=str(index), summary={"total": 4, "completed": 4, "failed": 0})
+            writer.flush()
+    return task_id
+
+
+@pytest.mark.parametrize('query', ['', '?offset=1&limit=2', '?limit=0'])
+def test_streamed_task_status_matches_the_plain_response(client, email_batch_task, query):
+    plain = client.get(f'/task_status/{email_batch_task}{query}').get_json()
+    separator = '&' if query else '?'
+    streamed = json.loads(client.get(f'/task_status/{email_batch_task}{query}{separator}stream=1').get_data())
+    assert streamed == plain
+
+
+def test_email_rows_come_in_the_order_they_finished(client, email_batch_task):
+    body = client.get(f'/task_status/{email_batch_task}?offset=1&limit=2').get_json()
+    assert [row["index"] for row in body["result"]["emails"]] == [0, 3]
+    assert (body["total_rows"], body["offset"], body["limit"]) == (4, 1, 2)
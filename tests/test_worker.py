@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def leased_task(app_module, task_id, worker_id):
+    task = app_module.Task(task_id=task_id, status='progressing', params='{"kind": "contacts_batch", "args": {}}',
+                           queued_at=datetime.utcnow())
+    task.worker_id = worker_id
+    task.lease_expires_at = datetime.utcnow() + timedelta(seconds=60)
+    app_module.db.session.add(task)
+    app_module.db.session.commit()
+
+
+def test_writes_stop_once_another_worker_holds_the_task(app_module):
+    with app_module.app.app_context():
+        leased_task(app_module, 'lease-taken-over', 'worker-b')
+        token = app_module.current_lease.set(app_module.TaskLease('lease-taken-over', 'worker-a', 60))
+        try:
+            writer = app_module.ResultWriter('lease-taken-over')
+            with pytest.raises(app_module.LeaseLost):
+                writer.add([{"domain": "a.com"}], checkpoint='a.com')
+                writer.flush()
+            # The final status update of the stale copy is dropped instead of overwriting the new owner's
+            app_module.update_task_status_and_result('lease-taken-over', 'error', {"message": "stale"})
+            with pytest.raises(app_module.LeaseLost):
+                writer.add([{"domain": "b.com"}])
+        finally:
+            app_module.current_lease.reset(token)
+
+        task = app_module.Task.query.filter_by(task_id='lease-taken-over').first()
+        assert (task.status, task.worker_id) == ('progressing', 'worker-b')
+        assert app_module.count_result_rows('lease-taken-over') == 0
+        assert app_module.TaskCheckpoint.query.filter_by(task_id='lease-taken-over').count() == 0
+
+
+def test_writes_extend_a_held_lease(app_module):
+    with app_module.app.app_context():
+        leased_task(app_module, 'lease-held', 'worker-a')
+        before = app_module.Task.query.filter_by(task_id='lease-held').first().lease_expires_at
+        token = app_module.current_lease.set(app_module.TaskLease('lease-held', 'worker-a', 600))
+        try:
+            writer = app_module.ResultWriter('lease-held')
+            writer.add([{"domain": "a.com"}], checkpoint='a.com')
+            writer.flush()
+        finally:
+            app_module.current_lease.reset(token)
+
+        app_module.db.session.expire_all()
+        assert app_module.count_result_rows('lease-held') == 1
+        assert app_module.Task.query.filter_by(task_id='lease-held').first().lease_expires_at > before
+
+
+def test_ensure_schema_adds_queue_indexes_to_an_existing_task_table(app_module, tmp_path, monkeypatch):
+    import sqlite3
+    path = tmp_path / 'legacy.db'
+    with sqlite3.connect(path) as conn:
+        # The task table as it was before the queue columns existed
+        conn.execute('CREATE TABLE task (id INTEGER PRIMARY KEY, task_id VARCHAR(36) NOT NULL UNIQUE, '
+                     'status VARCHAR(20) NOT NULL, result TEXT)')
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{path}')
+    legacy_app = app_module.create_app()
+
+    with legacy_app.app_context():
+        indexes = {index['name']: index['column_names']
+                   for index in app_module.db.inspect(app_module.db.engine).get_indexes('task')}
+    assert indexes['ix_task_status_queued_at'] == ['status', 'queued_at']
+    assert indexes['ix_task_lease_expires_at'] == ['lease_expires_at']
+
+
+def test_db_backend_refuses_tasks_once_the_queue_is_full(db_backend, client, monkeypatch):
+    with db_backend.app.app_context():
+        queued = db_backend.db_queue_counts()["queued"]
+    monkeypatch.setattr(db_backend, 'DB_TASK_QUEUE_MAX', queued + 1)
+
+    assert client.post('/contacts', json={"website": "first.example"}).status_code == 200
+    response = client.post('/contacts', json={"website": "second.example"})
+    assert response.status_code == 429 and response.headers['Retry-After'] == '30'
+    with db_backend.app.app_context():
+        # The refused task's row is removed again
+        assert db_backend.db_queue_counts()["queued"] == queued + 1
+
+
+def test_thread_backend_refuses_to_resume_a_task_leased_by_another_web_worker(app_module, client):
+    with app_module.app.app_context():
+        leased_task(app_module, 'leased-elsewhere', 'other-host-4242')
+
+    assert client.post('/task_resume/leased-elsewhere').json == {"error": "Task is still running."}
+    with app_module.app.app_context():
+        task = app_module.Task.query.filter_by(task_id='leased-elsewhere').first()
+        assert (task.status, task.worker_id) == ('progressing', 'other-host-4242')
+    assert 'leased-elsewhere' not in app_module.local_runs
@@ -1,20 +1,33 @@
 import random
 import re
+from functools import lru_cache
 from fuzzywuzzy import fuzz
 import time
+import urllib.parse
 
+LEGAL_ENTITIES = ['llc', 'inc', 'ltd', 'corporation', 'corp', 'lp']
+# '&' becomes 'and'; '.' and ',' are dropped
+_PUNCTUATION = str.maketrans({'&': 'and', '.': None, ',': None})
+# Everything that is neither alphanumeric nor whitespace (same as the str.isalnum/str.isspace test)
+_NON_ALNUM = re.compile(r'[^\w\s]|_')
 
+
+@lru_cache(maxsize=8192)
 def normalize_string(s):
-    legal_entities = ['llc', 'inc', 'ltd', 'corporation', 'corp', 'lp']
-    s = s.lower().replace('&', 'and').replace('.', '').replace(',', '')
-    for entity in legal_entities:
+    s = s.lower().translate(_PUNCTUATION)
+    for entity in LEGAL_ENTITIES:
         s = s.replace(entity, '')
     # Remove non-alphanumeric characters and extra spaces
-    s = ''.join(char for char in s if char.isalnum() or char.isspace())
+    s = _NON_ALNUM.sub('', s)
     s = ' '.join(s.split())  # Removes extra whitespace
     return s
 
 
+@lru_cache(maxsize=256)
+def _word_pattern(word):
+    return re.compile(r'\b' + re.escape(word) + r'\b', flags=re.IGNORECASE)
+
+
 def remove_word(original_string, word_to_remove):
     """
     Removes a specified word from a given string.
@@ -22,8 +35,7 @@ def remove_word(original_string, word_to_remove):
     :param word_to_remove: The word to remove.
     :return: String with the specified word removed.
     """
-    pattern = r'\b' + re.escape(word_to_remove) + r'\b'
-    return re.sub(pattern, '', original_string, flags=re.IGNORECASE).strip()
+    return _word_pattern(word_to_remove).sub('', original_string).strip()
 
 
 
@@ -41,6 +53,37 @@ def is_exact_match(title, search_term):
     return normalized_title == normalized_search_term
 
 
+def normalize_domain(url):
+    """
+    Reduces a website URL to its bare domain so different spellings of the same site compare equal.
+    :param url: A website URL, with or without scheme, www prefix, port or path.
+    :return: The lowercased domain, or None if nothing usable is left.
+    """
+    if not url:
+        return None
+    url = url.strip().lower()
+    if '://' not in url:
+        url = 'http://' + url
+    domain = urllib.parse.urlsplit(url).hostname or ''
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    return domain.strip('.') or None
+
+
+def normalize_phone(phone):
+    """
+    Reduces a phone number to its digits, without the US country code.
+    :param phone: A phone number in any format, e.g. "(555) 010-0001" or "+1 555.010.0001".
+    :return: The digits, or None if there are none.
+    """
+    if not phone:
+        return None
+    digits = re.sub(r'\D', '', phone)
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return digits or None
+
+
 def random_delay(min_seconds=1, max_seconds=3):
     """
     Introduces a random delay between requests.
@@ -61,6 +104,55 @@ def contains_all_search_terms(title, search_term):
     search_terms_lower = search_terms_normalized.split()
     return all(word in title_normalized for word in search_terms_lower)
 
+
+class NameMatcher:
+    """
+    Matches business names against one search term; build it once per search.
+    The search term is normalized once and titles go through the cached normalize_string.
+    :param search_term: The search term to match.
+    :param fuzzy_threshold: Optional 0-100 score at which score_batch counts a title as a match.
+    """
+
+    def __init__(self, search_term, fuzzy_threshold=None):
+        self.search_term = search_term
+        self.normalized = normalize_string(search_term)
+        self.words = self.normalized.split()
+        self.fuzzy_threshold = fuzzy_threshold
+
+    def contains_all(self, title):
+        """
+        Same result as contains_all_search_terms(title, search_term).
+        """
+        title_normalized = normalize_string(title)
+        return all(word in title_normalized for word in self.words)
+
+    def is_exact(self, title):
+        return normalize_string(title) == self.normalized
+
+    def match_batch(self, titles):
+        """
+        :return: One contains_all result per title.
+        """
+        return [self.contains_all(title) for title in titles]
+
+    def score(self, title):
+        """
+        Fuzzy similarity (0-100) between the normalized title and search term, order and duplicates ignored.
+        """
+        return fuzz.token_set_ratio(self.normalized, normalize_string(title), full_process=False)
+
+    def score_batch(self, titles):
+        """
+        :return: One (score, matched) pair per title; matched uses fuzzy_threshold when set, contains_all otherwise.
+        """
+        results = []
+        for title in titles:
+            score = self.score(title)
+            matched = score >= self.fuzzy_threshold if self.fuzzy_threshold is not None else self.contains_all(title)
+            results.append((score, matched))
+        return results
+
+
 USER_AGENTS = [
     # Windows Browsers - Chrome
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36",  # Chrome on Windows 10
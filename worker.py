@@ -0,0 +1,192 @@
+"""
+Worker process for TASK_BACKEND=db: claims queued tasks from the task table and runs them,
+so scraping capacity scales separately from the web dynos.
+
+    TASK_BACKEND=db python worker.py [--concurrency 2] [--kinds contacts contacts_batch]
+
+A claimed task carries a lease that the worker keeps extending while the task runs.
+If the worker dies, the lease runs out and the task is queued again (up to TASK_MAX_ATTEMPTS times);
+batch tasks then skip the items they had already checkpointed.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from app import (app, db, Task, TASK_BACKEND, TASK_KINDS, TASK_LEASE_SECONDS, TASK_HEARTBEAT_INTERVAL, TaskLease,
+                 current_lease, release_lease, renew_lease, run_task, update_task_status_and_result)
+
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', 3))
+WORKER_POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 2))
+
+
+def task_kind_filter(kinds):
+    # Task.params is JSON text starting with {"kind": "<kind>", so a prefix match avoids parsing it in SQL
+    return or_(*[Task.params.like(f'{{"kind": "{kind}"%') for kind in kinds])
+
+
+def claim_task(worker_id, kinds=None):
+    """
+    Takes the oldest queued task and leases it to `worker_id`.
+    Postgres skips rows other workers have locked; elsewhere (SQLite) the claim is a conditional UPDATE
+    that only one worker can win.
+    :param kinds: Only claim tasks of these kinds; all kinds by default.
+    :return: The claimed Task, or None if there is nothing to do.
+    """
+    now = datetime.utcnow()
+    query = Task.query.filter(Task.status == 'queued')
+    if kinds:
+        query = query.filter(task_kind_filter(kinds))
+    query = query.order_by(Task.queued_at, Task.id)
+    claim = {"status": 'progressing', "worker_id": worker_id,
+             "lease_expires_at": now + timedelta(seconds=TASK_LEASE_SECONDS)}
+
+    if db.engine.dialect.name == 'postgresql':
+        task = query.with_for_update(skip_locked=True).first()
+        if task is None:
+            db.session.rollback()
+            return None
+        for name, value in claim.items():
+            setattr(task, name, value)
+        task.attempts = (task.attempts or 0) + 1
+        db.session.commit()
+        return task
+
+    for candidate_id, in query.with_entities(Task.id).limit(5).all():
+        claimed = Task.query.filter(Task.id == candidate_id, Task.status == 'queued') \
+            .update(dict(claim, attempts=db.func.coalesce(Task.attempts, 0) + 1), synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Task, candidate_id)
+    return None
+
+
+def requeue_expired():
+    """
+    Puts tasks whose worker stopped renewing the lease back in the queue,
+    or fails them once they have used up TASK_MAX_ATTEMPTS.
+    :return: (requeued, failed) counts.
+    """
+    now = datetime.utcnow()
+    expired = Task.query.filter(Task.status == 'progressing', Task.lease_expires_at < now)
+    requeued = expired.filter(db.func.coalesce(Task.attempts, 0) < TASK_MAX_ATTEMPTS) \
+        .update({"status": 'queued', "worker_id": None, "lease_expires_at": None}, synchronize_session=False)
+    db.session.commit()
+
+    failed = 0
+    for task in Task.query.filter(Task.status == 'progressing', Task.lease_expires_at < now):
+        task.worker_id, task.lease_expires_at = None, None
+        update_task_status_and_result(task.task_id, 'error',
+                                      {'message': f"Task abandoned after {task.attempts} attempts"})
+        failed += 1
+    return requeued, failed
+
+
+class Heartbeat(threading.Thread):
+    """
+    Extends a task's lease until stop() is called. If the lease turns out to be lost, it marks it so;
+    the task's next write then raises app.LeaseLost instead of racing the worker that took the task over.
+    """
+
+    def __init__(self, lease):
+        super().__init__(daemon=True)
+        self.lease = lease
+        self._stopped = threading.Event()
+
+    def run(self):
+        with app.app_context():
+            while not self._stopped.wait(TASK_HEARTBEAT_INTERVAL):
+                try:
+                    if not renew_lease(self.lease.task_id, self.lease.worker_id):
+                        print(f"Lost the lease on task {self.lease.task_id}, stopping it")
+                        self.lease.lost.set()
+                        return
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Heartbeat for task {self.lease.task_id} failed: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+
+def run_claimed(task, worker_id):
+    params = json.loads(task.params)
+    kind = params["kind"]
+    pool_name, target = TASK_KINDS[kind]
+    waited = (datetime.utcnow() - task.queued_at).total_seconds() if task.queued_at else 0.0
+
+    lease = TaskLease(task.task_id, worker_id, TASK_LEASE_SECONDS)
+    heartbeat = Heartbeat(lease)
+    heartbeat.start()
+    token = current_lease.set(lease)  # Every write of the task checks it, see app.check_lease
+    try:
+        run_task(target, task.task_id, kind, pool_name, time.monotonic() - waited, params["args"])
+    finally:
+        current_lease.reset(token)
+        heartbeat.stop()
+        release_lease(task.task_id, worker_id)
+
+
+def work(worker_id, kinds, stopping):
+    with app.app_context():
+        while not stopping.is_set():
+            try:
+                task = claim_task(worker_id, kinds)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Claiming a task failed: {e}")
+                task = None
+            if task is None:
+                stopping.wait(WORKER_POLL_INTERVAL)
+                continue
+            print(f"{worker_id} running task {task.task_id}")
+            try:
+                run_claimed(task, worker_id)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Task {task.task_id} failed outside of its task function: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs queued tasks from the task table (TASK_BACKEND=db)")
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('WORKER_CONCURRENCY', 2)))
+    parser.add_argument('--kinds', nargs='*', default=os.environ.get('WORKER_KINDS', '').split() or None,
+                        choices=sorted(TASK_KINDS), help="Only run these task kinds")
+    args = parser.parse_args()
+
+    if TASK_BACKEND != 'db':
+        raise SystemExit("worker.py only runs with TASK_BACKEND=db; with the thread backend tasks run in the web process")
+
+    base_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    stopping = threading.Event()
+    # On SIGTERM no new tasks are claimed; running ones finish, or are requeued once their lease runs out
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    threads = [threading.Thread(target=work, args=(f"{base_id}-{i}", args.kinds, stopping), daemon=True)
+               for i in range(max(1, args.concurrency))]
+    for thread in threads:
+        thread.start()
+    print(f"Worker {base_id} started with {len(threads)} threads")
+
+    with app.app_context():
+        while not stopping.wait(min(TASK_LEASE_SECONDS / 2, 30)):
+            try:
+                requeued, failed = requeue_expired()
+                if requeued or failed:
+                    print(f"Requeued {requeued} abandoned tasks, gave up on {failed}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Requeueing abandoned tasks failed: {e}")
+
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
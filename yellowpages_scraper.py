@@ -1,169 +1,354 @@
-import requests
-from bs4 import BeautifulSoup
 import urllib.parse
-import time
-import random
-from utils import random_user_agent, random_delay, remove_word, contains_all_search_terms
+import os
+from concurrent.futures import ThreadPoolExecutor
+from utils import remove_word, normalize_string, NameMatcher
+from http_client import get_session
+from rate_limiter import HostRateLimiter
+from response_cache import get_cache
+from html_parsing import make_soup, SEARCH_RESULTS, LISTING_DETAIL
+import metrics
 
-def scrape_yellow_pages_first_page(search_terms, location, leadid):
-    headers = {
-        'User-Agent': random_user_agent(),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-    }
+DOMAIN = os.getenv('YELLOWPAGES_BASE_URL', "https://www.yellowpages.com")
+DETAIL_WORKERS = int(os.getenv('YELLOWPAGES_DETAIL_WORKERS', 4))
 
-    business_data = []
-    session = requests.Session()
-    session.headers.update(headers)
+# Shared by every task in the process so the politeness limit holds no matter how many searches run at once
+limiter = HostRateLimiter(rate=float(os.getenv('YELLOWPAGES_RATE', 1.0)),
+                          burst=int(os.getenv('YELLOWPAGES_BURST', 3)))
 
-    domain = "https://www.yellowpages.com"
-    page = 1
 
+def new_session():
+    # Every search shares the process-wide pooled session; it rotates the User-Agent per request.
+    # Its adapter leaves 429/5xx retries to the rate limiter, so retries take tokens too
+    return get_session(status_retries=False)
+
+
+def build_search_url(search_terms, location, page):
     search_terms_formatted = search_terms.replace('&', 'and')
     encoded_search_terms = urllib.parse.quote_plus(search_terms_formatted)
     encoded_location = urllib.parse.quote_plus(location)
+    return f"{DOMAIN}/search?search_terms={encoded_search_terms}&geo_location_terms={encoded_location}&page={page}"
 
-    base_url = f"https://www.yellowpages.com/search?search_terms={encoded_search_terms}&geo_location_terms={encoded_location}&page={page}"
 
-    random_delay()
+def fetch_page(session, url, page_type, use_cache=True):
+    """
+    Returns the HTML at `url` from the response cache, or fetches it through the rate limiter.
+    Only successful responses are cached.
+    :param page_type: "search" or "detail", which selects the cache TTL.
+    :return: A (status_code, html) tuple.
+    """
+    cache = get_cache() if use_cache else None
+    if cache:
+        html_content = cache.get(url, page_type)
+        if html_content is not None:
+            metrics.inc('response_cache_hit', page=page_type)
+            return 200, html_content
+        metrics.inc('response_cache_miss', page=page_type)
 
-    response = session.get(base_url)
-    random_delay()
-    # time.sleep(2)
-    
-    print(f"Processing search term: {search_terms}")
+    with metrics.timer(f'yp_{page_type}_fetch'):
+        response = limiter.get(session, url)
+    if cache and response.status_code == 200:
+        cache.put(url, page_type, response.text)
+    return response.status_code, response.text
+
+
+def fetch_search_page(session, search_terms, location, page, use_cache=True):
+    """
+    Fetches one page of search results.
+    :return: The list of `.result` nodes, or None if the page could not be retrieved.
+    """
+    status_code, html_content = fetch_page(session, build_search_url(search_terms, location, page), "search", use_cache)
+
+    if status_code != 200:
+        print(f"Failed to retrieve page {page}. Status code: {status_code}")
+        return None
+
+    return parse_search_page(html_content)
+
+
+def parse_search_page(html_content, parser=None, strained=None):
+    with metrics.timer('yp_search_parse'):
+        soup = make_soup(html_content, SEARCH_RESULTS, parser, strained)
+        return soup.find_all(class_="result")
+
+
+def parse_listing(result):
+    """
+    Extracts the fields shown on the search result itself, without any network access.
+    :return: A dict of fields plus the `detail_url` to visit when some of them are missing.
+    """
+    title = phone_number = full_address = website_url = city = state = zip_code = None
+
+    url_section = result.find("div", class_="info-section info-primary")
+    secondary_section = result.find("div", class_="info-section info-secondary")
+
+    title_tag = url_section.find("a", class_="business-name")
+    title = title_tag.text.strip() if title_tag else None
+
+
+    phone_tag = secondary_section.find("div", class_="phones phone primary")
+    phone_number = phone_tag.text.strip() if phone_tag else None
+
+    address_tag = secondary_section.find("div", class_="street-address")
+    full_address = address_tag.text.strip() if address_tag else None
+
+    try:
+        website_tag = url_section.find("a", class_="track-visit-website")
+        # print(website_tag)
+        website_url = website_tag['href'] if website_tag else None
+    except Exception as e:
+        website_url=None
+
+    locality=secondary_section.find('div',class_='locality')
+    if locality:
+        locality_text = locality.text.strip()
+        # Assuming the format is always "City, State ZIP"
+        locality_parts = locality_text.split(',')
+        city = locality_parts[0].strip() if len(locality_parts) > 0 else None
+        state_and_zip = locality_parts[1].strip().split(' ') if len(locality_parts) > 1 else [None, None]
+        state = state_and_zip[0] if len(state_and_zip) > 0 else None
+        zip_code = state_and_zip[1] if len(state_and_zip) > 1 else None
+
+    detail_url = None
+    # Check if all details are found; if not, the detail page has to be visited
+    if not (title and phone_number and full_address and website_url):
+        link = url_section.find("a", class_="business-name")['href']
+        detail_url = urllib.parse.urljoin(DOMAIN, link)
+
+    return {"title": title, "phone_number": phone_number, "full_address": full_address,
+            "website_url": website_url, "city": city, "state": state, "zip_code": zip_code,
+            "detail_url": detail_url}
+
+
+def enrich_listing(session, listing, use_cache=True):
+    """
+    Fills in the missing fields of a listing from its detail page.
+    """
+    status_code, description_content = fetch_page(session, listing["detail_url"], "detail", use_cache)
+    if status_code == 200:
+        apply_detail_page(listing, description_content)
+    return listing
+
+
+def apply_detail_page(listing, description_content, parser=None, strained=None):
+    title = listing["title"]
+    phone_number = listing["phone_number"]
+    full_address = listing["full_address"]
+    website_url = listing["website_url"]
+    city, state, zip_code = listing["city"], listing["state"], listing["zip_code"]
+
+    with metrics.timer('yp_detail_parse'):
+        description_soup = make_soup(description_content, LISTING_DETAIL, parser, strained)
+    description_results = description_soup.find("div", id="listing-card")
+    if description_results:
+        if not title:
+            try:
+                title_element = description_results.find("h1", class_="business-name")
+                title = title_element.text.strip() if title_element else None
+
+
+            except:
+                title = None
+
+        if not phone_number:
+            try:
+                phone_element = description_results.find("a", class_="phone")
+                phone_number = phone_element.text.strip() if phone_element else None
+            except:
+                phone_number=None
 
-    if response.status_code == 200:
-        html_content = response.text
-        soup = BeautifulSoup(html_content, "html.parser")
-        time.sleep(3)
-        results = soup.find_all(class_="result")
-
-        if not results:
-            print(f"No results on page {page}. Ending pagination.")
-            return business_data
-            
-        for result in results:
-            title = phone_number = full_address = website_url = city = state = zip_code = None
+        if not full_address:
             try:
+                address_element = description_results.find("span", class_="address").find('span')
+                full_address = address_element.text.strip() if address_element else None
+            except:
+                full_address=None
+
+
+        if not city or state or zip_code:
+
+            try:
+                address_tag = description_results.find("span", class_="address")
+                if address_tag:
+                    # Extract the inner text from the first span which is the street address
+                    street_address_span = address_tag.find("span")
+                    if street_address_span:
+                        street_address = street_address_span.text.strip()
+                        # Replace the street address with an empty string to get the city, state, ZIP
+                        locality_info = address_tag.text.replace(street_address, '').strip()
+                    else:
+                        locality_info = address_tag.text.strip()
 
-                url_section = result.find("div", class_="info-section info-primary")
-                secondary_section = result.find("div", class_="info-section info-secondary") 
-                
-                title_tag = url_section.find("a", class_="business-name")
-                title = title_tag.text.strip() if title_tag else None
-               
-
-                phone_tag = secondary_section.find("div", class_="phones phone primary")
-                phone_number = phone_tag.text.strip() if phone_tag else None
- 
-                address_tag = secondary_section.find("div", class_="street-address")
-                full_address = address_tag.text.strip() if address_tag else None
-
-                try:
-                    website_tag = url_section.find("a", class_="track-visit-website")
-                    # print(website_tag)
-                    website_url = website_tag['href'] if website_tag else None
-                except Exception as e:
-                    website_url=None
-
-                locality=secondary_section.find('div',class_='locality')
-                if locality:
-                    locality_text = locality.text.strip()
                     # Assuming the format is always "City, State ZIP"
-                    locality_parts = locality_text.split(',')
+                    locality_parts = locality_info.split(',')
                     city = locality_parts[0].strip() if len(locality_parts) > 0 else None
                     state_and_zip = locality_parts[1].strip().split(' ') if len(locality_parts) > 1 else [None, None]
                     state = state_and_zip[0] if len(state_and_zip) > 0 else None
                     zip_code = state_and_zip[1] if len(state_and_zip) > 1 else None
-            
-
-                # print(title)
-                # Check if all details are found; if not, go to the detail page
-                if not (title and phone_number and full_address and website_url):
-                    random_delay() 
-                    link = url_section.find("a", class_="business-name")['href']
-                    full_url = urllib.parse.urljoin(domain, link)
-                    description_response = session.get(full_url)
-                    time.sleep(3)
-                    if description_response.status_code == 200:
-                        description_content = description_response.text
-                        description_soup = BeautifulSoup(description_content, "html.parser")
-                        description_results = description_soup.find("div", id="listing-card")
-                        if description_results:
-                            if not title:
-                                try:
-                                    title_element = description_results.find("h1", class_="business-name")
-                                    title = title_element.text.strip() if title_element else None
-                                   
-
-                                except:
-                                    title = None           
-                                    
-                            if not phone_number:
-                                try:
-                                    phone_element = description_results.find("a", class_="phone")
-                                    phone_number = phone_element.text.strip() if phone_element else None
-                                except:
-                                    phone_number=None
-
-                            if not full_address:
-                                try:
-                                    address_element = description_results.find("span", class_="address").find('span')
-                                    full_address = address_element.text.strip() if address_element else None
-                                except:
-                                    full_address=None  
-
-
-                            if not city or state or zip_code:  
-                                
-                                try:
-                                    address_tag = description_results.find("span", class_="address")
-                                    if address_tag:
-                                        # Extract the inner text from the first span which is the street address
-                                        street_address_span = address_tag.find("span")
-                                        if street_address_span:
-                                            street_address = street_address_span.text.strip()
-                                            # Replace the street address with an empty string to get the city, state, ZIP
-                                            locality_info = address_tag.text.replace(street_address, '').strip()
-                                        else:
-                                            locality_info = address_tag.text.strip()
-                                        
-                                        # Assuming the format is always "City, State ZIP"
-                                        locality_parts = locality_info.split(',')
-                                        city = locality_parts[0].strip() if len(locality_parts) > 0 else None
-                                        state_and_zip = locality_parts[1].strip().split(' ') if len(locality_parts) > 1 else [None, None]
-                                        state = state_and_zip[0] if len(state_and_zip) > 0 else None
-                                        zip_code = state_and_zip[1] if len(state_and_zip) > 1 else None
-                                except Exception as e:
-                                    print(f"An error occurred while trying to get the locality information: {e}")
-                                    city = None
-                                    state = None
-                                    zip_code = None
-                            if not website_url:
-                                try:
-                                    website_tag_detail = description_soup.find("a", class_="website-link dockable")
-                                    website_url = website_tag_detail['href'] if website_tag_detail else None
-                                except Exception:
-                                    website_url = None        
-
-                if contains_all_search_terms(title, search_terms):
-                    word_to_remove = "- CLOSED"  # Replace with the word you want to remove
-                    cleaned_title = remove_word(title, word_to_remove)
-                    business_data.append((leadid, cleaned_title, phone_number, website_url, full_address, city, state, zip_code))
-
-                # Removed the break statement to allow for more results to be added
-
             except Exception as e:
-                print(f"An error occurred: {e}")
-        
-    else:
-        print(f"Failed to retrieve page {page}. Status code: {response.status_code}")
+                print(f"An error occurred while trying to get the locality information: {e}")
+                city = None
+                state = None
+                zip_code = None
+        if not website_url:
+            try:
+                website_tag_detail = description_soup.find("a", class_="website-link dockable")
+                website_url = website_tag_detail['href'] if website_tag_detail else None
+            except Exception:
+                website_url = None
+
+    listing.update(title=title, phone_number=phone_number, full_address=full_address, website_url=website_url,
+                   city=city, state=state, zip_code=zip_code)
+    return listing
+
 
-   
+def apply_known(listing, known):
+    """
+    Fills the missing fields of a listing from a business already in the lead index.
+    The detail page is skipped when that leaves nothing it would be needed for.
+    :param known: A dict of the fields the lead index can vouch for, or None; another branch of the same
+        business supplies no phone number or address, so such a listing still gets its detail page.
+    """
+    if not known:
+        return listing
+    for field, value in known.items():
+        if not listing[field] and value:
+            listing[field] = value
+    if listing["title"] and listing["phone_number"] and listing["full_address"] and listing["website_url"]:
+        listing["detail_url"] = None
+    return listing
+
+
+def finish_listing(listing, matcher, leadid):
+    title = listing["title"]
+    if matcher.contains_all(title):
+        word_to_remove = "- CLOSED"  # Replace with the word you want to remove
+        cleaned_title = remove_word(title, word_to_remove)
+        return (leadid, cleaned_title, listing["phone_number"], listing["website_url"], listing["full_address"],
+                listing["city"], listing["state"], listing["zip_code"])
+    return None
+
+
+def parse_results(results, session, matcher, leadid, detail_workers, use_cache=True, lookup_known=None):
+    """
+    Turns the `.result` nodes of one page into listing tuples, fetching the detail pages
+    of incomplete listings concurrently. Listings that fail to parse are skipped.
+    :param lookup_known: Called in this thread with the incomplete listings before any detail page is fetched;
+        returns the already known fields of each one (or None) in the same order.
+    """
+    listings = []
+    for result in results:
+        try:
+            listings.append(parse_listing(result))
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            listings.append(None)
+
+    def enrich(listing):
+        try:
+            return enrich_listing(session, listing, use_cache)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return None
+
+    incomplete = [i for i, listing in enumerate(listings) if listing and listing["detail_url"]]
+    if incomplete and lookup_known:
+        try:
+            with metrics.timer('lead_index_lookup'):
+                known_listings = lookup_known([listings[i] for i in incomplete])
+            for i, known in zip(incomplete, known_listings):
+                apply_known(listings[i], known)
+        except Exception as e:
+            print(f"Lead index lookup failed: {e}")
+        incomplete = [i for i in incomplete if listings[i]["detail_url"]]
+    if incomplete:
+        with ThreadPoolExecutor(max_workers=max(1, min(detail_workers, len(incomplete)))) as executor:
+            for i, listing in zip(incomplete, executor.map(metrics.propagate(enrich),
+                                                           [listings[i] for i in incomplete])):
+                listings[i] = listing
+
+    business_data = []
+    for listing in listings:
+        if listing is None:
+            continue
+        try:
+            finished = finish_listing(listing, matcher, leadid)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            continue
+        if finished:
+            business_data.append(finished)
+    return business_data
+
+
+def listing_key(listing):
+    # The same business can show up as an ad and as an organic result, or on more than one page
+    _, title, phone_number, website_url, full_address, _, _, _ = listing
+    return (normalize_string(title or ''), phone_number, full_address)
+
+
+def scrape_yellow_pages_pages(search_terms, location, leadid, max_pages=1, max_results=None, page_workers=3, dedupe=True,
+                              detail_workers=None, use_cache=True, on_page=None, lookup_known=None):
+    """
+    Crawls up to `max_pages` result pages, fetching `page_workers` pages at a time.
+    Stops at the first page that has no results and merges every page into one listing set.
+    All requests go through the per-host rate limiter instead of fixed sleeps.
+    :param max_results: Stop once this many listings have been collected.
+    :param dedupe: Drop listings already seen on an earlier result or page.
+    :param use_cache: Read and write the on-disk response cache; False always refetches.
+    :param on_page: Called with the new listings of each page as soon as that page is done.
+    :param lookup_known: See parse_results; lets known businesses skip their detail page.
+    :return: A list of listing tuples, or None if nothing was found.
+    """
+    session = new_session()
+    matcher = NameMatcher(search_terms)
+    business_data = []
+    seen = set()
+    if detail_workers is None:
+        detail_workers = DETAIL_WORKERS
+
+    print(f"Processing search term: {search_terms}")
+
+    page = 1
+    with ThreadPoolExecutor(max_workers=max(1, page_workers)) as executor:
+        while page <= max_pages:
+            wave = range(page, min(page + page_workers, max_pages + 1))
+            fetch = metrics.propagate(lambda p: fetch_search_page(session, search_terms, location, p, use_cache))
+            pages = executor.map(fetch, wave)
+
+            for current_page, results in zip(wave, pages):
+                if results is None:
+                    return business_data or None
+                if not results:
+                    print(f"No results on page {current_page}. Ending pagination.")
+                    return business_data
+
+                page_data = []
+                for listing in parse_results(results, session, matcher, leadid, detail_workers, use_cache,
+                                             lookup_known):
+                    if dedupe:
+                        key = listing_key(listing)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                    page_data.append(listing)
+                    if max_results and len(business_data) + len(page_data) >= max_results:
+                        break
+
+                business_data.extend(page_data)
+                if on_page and page_data:
+                    on_page(page_data)
+                if max_results and len(business_data) >= max_results:
+                    return business_data
+
+            page += len(wave)
 
     if business_data:
-        
+
         return business_data  # Return scraped data for further processing
     else:
         return None
+
+
+def scrape_yellow_pages_first_page(search_terms, location, leadid, use_cache=True, on_page=None, lookup_known=None):
+    return scrape_yellow_pages_pages(search_terms, location, leadid, max_pages=1, page_workers=1, dedupe=False,
+                                     use_cache=use_cache, on_page=on_page, lookup_known=lookup_known)